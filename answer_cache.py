@@ -0,0 +1,153 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from manifest import content_hash
+
+
+def _normalize_text(text):
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def history_key(history):
+    # Histories that differ only in whitespace or case count as the same conversation.
+    normalized = _normalize_text(history)
+    return content_hash(normalized) if normalized else ""
+
+
+class SemanticAnswerCache:
+    """Answers for one customer, looked up by cosine similarity of the query embedding.
+
+    Queries answered without an embedding (the lexical fast path) match on
+    their normalized text only.
+    """
+
+    def __init__(self, threshold=0.95, ttl_seconds=3600, max_entries=500, clock=time.monotonic):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, query, embedding, history, version):
+        key = history_key(history)
+        text = _normalize_text(query)
+        vector = _normalize(embedding) if embedding is not None else None
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            best_id, best_score = None, self.threshold
+            for entry_id, entry in self._entries.items():
+                if entry["history"] != key or entry["version"] != version:
+                    continue
+                if entry["query"] == text:
+                    best_id, best_score = entry_id, 1.0
+                    break
+                if vector is None or entry["vector"] is None:
+                    continue
+                score = float(np.dot(entry["vector"], vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            return {"answer": entry["answer"], "metadata": entry["metadata"], "similarity": best_score}
+
+    def put(self, query, embedding, history, version, answer, metadata=None):
+        if not answer:
+            return
+        with self._lock:
+            self._entries[self._next_id] = {
+                "query": _normalize_text(query),
+                "vector": _normalize(embedding) if embedding is not None else None,
+                "history": history_key(history),
+                "version": version,
+                "answer": answer,
+                "metadata": metadata or {},
+                "created": self.clock(),
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def _expire(self, now):
+        # Entries are in LRU order, not insertion order, so every entry is checked.
+        expired = [entry_id for entry_id, entry in self._entries.items() if now - entry["created"] > self.ttl_seconds]
+        for entry_id in expired:
+            del self._entries[entry_id]
+        self.expirations += len(expired)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+class AnswerCacheRegistry:
+    def __init__(self, **cache_options):
+        self.cache_options = cache_options
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def get(self, customer_id):
+        with self._lock:
+            if customer_id not in self._caches:
+                self._caches[customer_id] = SemanticAnswerCache(**self.cache_options)
+            return self._caches[customer_id]
+
+    def invalidate(self, customer_id):
+        cache = self._caches.get(customer_id)
+        if cache is not None:
+            cache.invalidate()
+
+    def drop(self, customer_id):
+        with self._lock:
+            self._caches.pop(customer_id, None)
+
+    def stats(self, customer_id=None):
+        if customer_id is not None:
+            return {customer_id: self.get(customer_id).stats()}
+        with self._lock:
+            caches = dict(self._caches)
+        return {customer: cache.stats() for customer, cache in caches.items()}
+
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+answer_caches = AnswerCacheRegistry(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600)),
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 500)),
+)
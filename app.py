@@ -1,20 +1,39 @@
-from fastapi import FastAPI, HTTPException, Body, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Body, UploadFile, File, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
-from retriever import generate_response, rag_manager
+from typing import List, Dict, Optional
+from contextlib import asynccontextmanager
+from retriever import agenerate_response, astream_response, asummarize_history, rag_manager
+from answer_cache import answer_caches
+from jobs import IngestionQueue
+from sessions import SessionStore
+from tenant_locks import atomic_write, atomic_writer, tenant_locks
+import asyncio
 import os
 import shutil
 from dotenv import load_dotenv
 import uvicorn
 import json
-from scrapy.crawler import CrawlerProcess
-
-from scrapy.utils.log import configure_logging
-from myproject.myproject.spiders.myspider import ContentExtractorSpider
+import threading
 
 load_dotenv()
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Comma-separated customer ids whose collections are opened in the background while the server starts serving.
+    customer_ids = [customer_id.strip() for customer_id in os.getenv("WARMUP_CUSTOMERS", "").split(",") if customer_id.strip()]
+    if customer_ids:
+        threading.Thread(target=rag_manager.warm_up, args=(customer_ids,), daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
+ingestion_queue = IngestionQueue(rag_manager.update_customer_dataset, max_workers=int(os.getenv("INGESTION_WORKERS", 2)))
+session_store = SessionStore(
+    asummarize_history,
+    window_turns=int(os.getenv("SESSION_WINDOW_TURNS", 6)),
+    max_history_tokens=int(os.getenv("SESSION_MAX_HISTORY_TOKENS", 1200)),
+    ttl_seconds=float(os.getenv("SESSION_TTL_SECONDS", 3600)),
+)
 
 class ChatMessage(BaseModel):
     role: str
@@ -23,25 +42,120 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     customer_id: str
+    # With a session id the server keeps the history and only the new message needs to be sent.
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
+    session_id: Optional[str] = None
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+def request_turns(messages):
+    turns = []
+    for msg in messages:
+        if msg.role == "user":
+            turns.append((msg.content, ""))
+        elif msg.role == "assistant" and turns:
+            turns[-1] = (turns[-1][0], msg.content)
+    return turns
+
+def prepare_chat(request):
+    """Return (query, formatted history, session or None) for a chat request."""
     if not request.messages:
         raise HTTPException(status_code=400, detail="No messages provided")
-    
-    history = [{"human": msg.content, "ai": ""} for msg in request.messages[:-1] if msg.role == "user"]
-    for i, msg in enumerate(request.messages[:-1]):
-        if msg.role == "assistant" and i > 0:
-            history[i-1]["ai"] = msg.content
-    
     query = request.messages[-1].content
-    formatted_history = "\n".join([f"Human: {h['human']}\nAI: {h['ai']}" for h in history])
-    
-    response = generate_response(query, formatted_history, request.customer_id)
-    return ChatResponse(response=response)
+    if request.session_id is None:
+        return query, session_store.bounded_history(request_turns(request.messages[:-1])), None
+    session = session_store.get(request.customer_id, request.session_id)
+    return query, session_store.history(session), session
+
+def finish_turn(session, query, response, background_tasks):
+    if session is not None:
+        session_store.record(session, query, response)
+        background_tasks.add_task(session_store.compact, session)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, background_tasks: BackgroundTasks):
+    query, formatted_history, session = prepare_chat(request)
+    response = await agenerate_response(query, formatted_history, request.customer_id)
+    finish_turn(session, query, response, background_tasks)
+    return ChatResponse(response=response, session_id=request.session_id)
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, background_tasks: BackgroundTasks):
+    query, formatted_history, session = prepare_chat(request)
+
+    async def events():
+        tokens = []
+        try:
+            async for event, data in astream_response(query, formatted_history, request.customer_id):
+                if event == "token":
+                    tokens.append(data)
+                    yield sse_event(event, {"text": data})
+                else:
+                    yield sse_event(event, {**data, "session_id": request.session_id})
+        except Exception as e:
+            # Headers are already sent, so failures are reported in-band.
+            yield sse_event("error", {"detail": str(e)})
+            return
+        finish_turn(session, query, "".join(tokens), background_tasks)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=background_tasks)
+
+@app.post("/sessions")
+async def create_session(customer_id: str = Body(..., embed=True)):
+    return {"session_id": session_store.get(customer_id).id}
+
+@app.delete("/sessions/{customer_id}/{session_id}")
+async def delete_session(customer_id: str, session_id: str):
+    if not session_store.delete(customer_id, session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return {"message": f"Session {session_id} deleted"}
+
+@app.get("/tenants/stats")
+async def tenant_stats():
+    return rag_manager.stats()
+
+@app.get("/answer_cache/stats")
+async def answer_cache_stats(customer_id: Optional[str] = None):
+    return {"answer_cache": answer_caches.stats(customer_id)}
+
+def save_upload(file, file_path):
+    with atomic_writer(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+def move_documents(customer_id, temp_customer_dir, final_customer_dir):
+    with tenant_locks.get(customer_id).files():
+        os.makedirs(final_customer_dir, exist_ok=True)
+        for filename in os.listdir(temp_customer_dir):
+            shutil.move(os.path.join(temp_customer_dir, filename), os.path.join(final_customer_dir, filename))
+        shutil.rmtree(temp_customer_dir)
+
+def write_dataset_file(customer_id, file_name, text):
+    customer_dir = f"Dataset_customer{customer_id}"
+    os.makedirs(customer_dir, exist_ok=True)
+    text_file_path = os.path.join(customer_dir, file_name)
+    # Ingestion may be parsing this directory right now: it sees the old file or the new one, never half of it.
+    atomic_write(text_file_path, text)
+    return text_file_path
+
+def add_faq_entry(customer_id, question, answer):
+    customer_dir = f"Dataset_customer{customer_id}"
+    os.makedirs(customer_dir, exist_ok=True)
+    faq_file_path = os.path.join(customer_dir, f"faq_{customer_id}.json")
+    # Concurrent additions for one customer would otherwise each read the file and overwrite the other's entry.
+    with tenant_locks.get(customer_id).files():
+        if os.path.exists(faq_file_path):
+            with open(faq_file_path, 'r', encoding='utf-8') as faq_file:
+                faq_data = json.load(faq_file)
+        else:
+            faq_data = {}
+        faq_data[question] = answer
+        atomic_write(faq_file_path, json.dumps(faq_data, indent=4))
+    return faq_file_path
 
 @app.post("/upload_document")
 async def upload_document(customer_id: str = Body(...), file: UploadFile = File(...)):
@@ -51,8 +165,7 @@ async def upload_document(customer_id: str = Body(...), file: UploadFile = File(
         os.makedirs(temp_customer_dir, exist_ok=True)
 
         file_path = os.path.join(temp_customer_dir, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await asyncio.to_thread(save_upload, file, file_path)
         
         return JSONResponse(content={
             "message": f"File uploaded successfully to temporary directory for customer {customer_id}",
@@ -70,37 +183,61 @@ async def finish_documents(customer_id: str = Body(...)):
             raise HTTPException(status_code=400, detail=f"No temporary documents found for customer {customer_id}")
         
   
-        os.makedirs(final_customer_dir, exist_ok=True)
-        for filename in os.listdir(temp_customer_dir):
-            shutil.move(os.path.join(temp_customer_dir, filename), os.path.join(final_customer_dir, filename))
-        
-   
-        shutil.rmtree(temp_customer_dir)
-        await update_dataset(customer_id, final_customer_dir)     
+        await asyncio.to_thread(move_documents, customer_id, temp_customer_dir, final_customer_dir)
+        job = ingestion_queue.submit(customer_id, final_customer_dir)
         return JSONResponse(content={
-            "message": f"Documents finalized and dataset updated for customer {customer_id}"
-        }, status_code=200)
+            "message": f"Documents finalized and dataset update queued for customer {customer_id}",
+            "job_id": job.id
+        }, status_code=202)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/update_dataset")
 async def update_dataset(customer_id: str = Body(...), new_directory: str = Body(...)):
     try:
-        rag_manager.update_customer_dataset(customer_id, new_directory)
-        return {"message": f"Dataset updated successfully for customer {customer_id}"}
+        job = ingestion_queue.submit(customer_id, new_directory)
+        return JSONResponse(content={
+            "message": f"Dataset update queued for customer {customer_id}",
+            "job_id": job.id
+        }, status_code=202)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs")
+async def list_jobs(customer_id: Optional[str] = None):
+    return {"jobs": [job.to_dict() for job in ingestion_queue.list(customer_id)]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = ingestion_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
         
+def run_crawler(start_url):
+    # Scrapy and the spider are only imported when a crawl actually runs.
+    from scrapy.crawler import CrawlerProcess
+    from myproject.myproject.spiders.myspider import ContentExtractorSpider
+
+    process = CrawlerProcess(settings={
+        'FEED_FORMAT': 'json',
+        'FEED_URI': 'output.json',
+        'FEED_EXPORT_ENCODING': 'utf-8',
+    })
+    process.crawl(ContentExtractorSpider, start_url=start_url)
+    process.start()
+
 @app.post("/run_scrape")
 async def run_scrape(start_url: str, customer_id: str):
     try:    
-        # process = CrawlerProcess(settings={
-        #     'FEED_FORMAT': 'json',
-        #     'FEED_URI': 'output.json',
-        #     'FEED_EXPORT_ENCODING': 'utf-8',
-        # })
-        # process.crawl(ContentExtractorSpider, start_url=start_url)
-        # process.start()
+        # run_crawler(start_url)
 
 
         with open('output.json', 'r', encoding='utf-8') as json_file:
@@ -110,15 +247,14 @@ async def run_scrape(start_url: str, customer_id: str):
         for item in scraped_data:
             text_content += f"{item['content']}\n\n"
 
-        customer_dir = f"Dataset_customer{customer_id}"
-        os.makedirs(customer_dir, exist_ok=True)
-        
-        text_file_path = os.path.join(customer_dir, f"scraped_content_{customer_id}.txt")
-        with open(text_file_path, 'w', encoding='utf-8') as text_file:
-            text_file.write(text_content)
+        text_file_path = await asyncio.to_thread(write_dataset_file, customer_id, f"scraped_content_{customer_id}.txt", text_content)
 
         new_directory = os.path.dirname(text_file_path)
-        await update_dataset(customer_id, new_directory)
+        job = ingestion_queue.submit(customer_id, new_directory)
+        return JSONResponse(content={
+            "message": f"Scraped content saved and dataset update queued for customer {customer_id}",
+            "job_id": job.id
+        }, status_code=202)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -127,50 +263,28 @@ async def run_scrape(start_url: str, customer_id: str):
 @app.post("/add_text_to_dataset")
 async def add_text_to_dataset(customer_id: str = Body(...), user_text: str = Body(...)):
     try:
-        
-        customer_dir = f"Dataset_customer{customer_id}"
-        os.makedirs(customer_dir, exist_ok=True)
-
-        
-        text_file_path = os.path.join(customer_dir, f"manual_input_{customer_id}.txt")
-        with open(text_file_path, 'w', encoding='utf-8') as text_file:
-            text_file.write(user_text)
-
-        await update_dataset(customer_id, customer_dir)
+        text_file_path = await asyncio.to_thread(write_dataset_file, customer_id, f"manual_input_{customer_id}.txt", user_text)
+        job = ingestion_queue.submit(customer_id, os.path.dirname(text_file_path))
 
         return JSONResponse(content={
             "message": f"Text added successfully to dataset for customer {customer_id}",
-            "text_file": f"manual_input_{customer_id}.txt"
-        }, status_code=200)
+            "text_file": f"manual_input_{customer_id}.txt",
+            "job_id": job.id
+        }, status_code=202)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/add_faq")
 async def add_faq(customer_id: str = Body(...), question: str = Body(...), answer: str = Body(...)):
     try:
-        customer_dir = f"Dataset_customer{customer_id}"
-        os.makedirs(customer_dir, exist_ok=True)
-        
-        faq_file_path = os.path.join(customer_dir, f"faq_{customer_id}.json")
-        
-        
-        if os.path.exists(faq_file_path):
-            with open(faq_file_path, 'r', encoding='utf-8') as faq_file:
-                faq_data = json.load(faq_file)
-        else:
-            faq_data = {}
-
-        faq_data[question] = answer
-
-        with open(faq_file_path, 'w', encoding='utf-8') as faq_file:
-            json.dump(faq_data, faq_file, indent=4)
-
-        await update_dataset(customer_id, customer_dir)
+        faq_file_path = await asyncio.to_thread(add_faq_entry, customer_id, question, answer)
+        job = ingestion_queue.submit(customer_id, os.path.dirname(faq_file_path))
 
         return JSONResponse(content={
             "message": f"FAQ added successfully for customer {customer_id}",
-            "faq_file": f"faq_{customer_id}.json"
-        }, status_code=200)
+            "faq_file": f"faq_{customer_id}.json",
+            "job_id": job.id
+        }, status_code=202)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
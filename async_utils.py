@@ -0,0 +1,14 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_sync(coro):
+    # FastAPI handlers call into ingestion from inside a running event loop,
+    # where asyncio.run() is not allowed, so hop to a worker thread there.
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
@@ -0,0 +1,31 @@
+"""Offline stand-ins so the benchmarks run without a Google API key."""
+import os
+import tempfile
+
+os.environ.setdefault("GOOGLE_API_KEY2", "offline-benchmark")
+
+from langchain_core.documents import Document
+
+from chunker import StructuredChunker
+from embedding_cache import HashingEmbeddings
+
+
+def sample_texts(count, path="scraped_content_3.txt"):
+    with open(path, "r", encoding="utf-8") as f:
+        chunks = [text for _, text in StructuredChunker(256, 0).split_text(f.read())]
+    return [chunks[i % len(chunks)] + ("" if i < len(chunks) else f" ({i})") for i in range(count)]
+
+
+def offline_customer(customer_id, texts, labels=10, workdir=None):
+    import retriever
+
+    rag = retriever.CustomerRAG(customer_id)
+    rag.chroma_persist_dir = os.path.join(workdir or tempfile.mkdtemp(), f"chroma_db_customer{customer_id}")
+    rag.embeddings = HashingEmbeddings()
+    rag.add_chunks(
+        [Document(page_content=text, metadata={"label": f"topic {i % labels}", "start_index": 0, "source": f"doc{i}.txt"})
+         for i, text in enumerate(texts)],
+        ids=[f"chunk-{i}" for i in range(len(texts))],
+    )
+    retriever.rag_manager.customer_rags[customer_id] = rag
+    return rag
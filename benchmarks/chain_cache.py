@@ -0,0 +1,39 @@
+"""Per-request cost of rebuilding the RAG chain versus reusing the cached one.
+
+Run from the repository root:
+
+    python -m benchmarks.chain_cache [requests]
+"""
+import sys
+import time
+
+from benchmarks._offline import offline_customer, sample_texts
+
+import retriever
+from langchain_core.language_models import FakeListChatModel
+
+
+def timed(label, requests, call):
+    started = time.perf_counter()
+    for _ in range(requests):
+        call()
+    per_request = (time.perf_counter() - started) / requests * 1000
+    print(f"{label:<34} {per_request:8.3f} ms/request")
+    return per_request
+
+
+def main(requests):
+    rag = offline_customer("bench", sample_texts(300))
+    retriever.model = FakeListChatModel(responses=["An answer."])
+    request = {"query": "Which engineering courses were scrapped?", "history": ""}
+
+    build = timed("build chain only (old, per request)", requests, lambda: retriever.build_rag_chain(rag))
+    cached = timed("cached chain lookup", requests, lambda: retriever.get_rag_chain("bench"))
+    uncached_total = timed("build + invoke (old path)", requests, lambda: retriever.build_rag_chain(rag).invoke(request))
+    cached_total = timed("cached + invoke", requests, lambda: retriever.get_rag_chain("bench").invoke(request))
+    print(f"construction overhead removed: {build - cached:.3f} ms/request "
+          f"({(uncached_total - cached_total) / uncached_total:.1%} of end-to-end latency with a zero-latency model)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,70 @@
+"""Concurrent /chat requests on one worker: blocking vs. async generation.
+
+The Gemini call is replaced by a fixed-latency fake model so the effect
+of blocking the event loop is visible without network access. Run from
+the repository root:
+
+    python -m benchmarks.chat_load [concurrent_requests] [model_latency_seconds]
+"""
+import asyncio
+import sys
+import time
+
+from benchmarks._offline import offline_customer, sample_texts
+
+import httpx
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+import app
+import retriever
+from answer_cache import AnswerCacheRegistry
+
+
+def fake_model(latency):
+    def _invoke(prompt):
+        time.sleep(latency)
+        return AIMessage(content="An answer.")
+
+    async def _ainvoke(prompt):
+        await asyncio.sleep(latency)
+        return AIMessage(content="An answer.")
+
+    return RunnableLambda(_invoke, afunc=_ainvoke)
+
+
+@app.app.post("/chat_blocking", response_model=app.ChatResponse)
+async def chat_blocking(request: app.ChatRequest):
+    # The handler as it was before: synchronous generation inside the event loop.
+    response = retriever.generate_response(request.messages[-1].content, "", request.customer_id)
+    return app.ChatResponse(response=response)
+
+
+async def fire(client, path, requests):
+    payload = {"customer_id": "bench", "messages": [{"role": "user", "content": "Which courses were scrapped?"}]}
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(client.post(path, json=payload) for _ in range(requests)))
+    assert all(response.status_code == 200 for response in responses)
+    return time.perf_counter() - started
+
+
+async def main(requests, latency):
+    offline_customer("bench", sample_texts(300))
+    retriever.model = fake_model(latency)
+    # Every request asks the same question, so the answer cache would hide the model latency.
+    retriever.answer_caches = AnswerCacheRegistry(max_entries=0)
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await fire(client, "/chat", 1)
+        blocking = await fire(client, "/chat_blocking", requests)
+        non_blocking = await fire(client, "/chat", requests)
+    print(f"{requests} concurrent chats, {latency * 1000:.0f} ms model latency")
+    print(f"blocking handler: {blocking:6.2f} s total ({blocking / requests * 1000:7.1f} ms per chat, serialized)")
+    print(f"async handler:    {non_blocking:6.2f} s total ({non_blocking / requests * 1000:7.1f} ms per chat, overlapped)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.5,
+    ))
@@ -0,0 +1,65 @@
+"""Compare the old double-split chunking path with StructuredChunker.
+
+Run from the repository root:
+
+    python -m benchmarks.chunking [file ...]
+
+Defaults to the scraped site in scraped_content_3.txt and the pages in
+output.json.
+"""
+import json
+import sys
+import time
+
+from langchain_core.documents import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from chunker import StructuredChunker, estimate_tokens
+
+
+def load_corpus(paths):
+    documents = []
+    for path in paths:
+        if path.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                documents.extend(Document(page_content=item["content"], metadata={"source": item["url"]}) for item in json.load(f))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                documents.append(Document(page_content=f.read(), metadata={"source": path}))
+    return documents
+
+
+def double_split(documents):
+    # What CustomerRAG.load_documents used to do: load_and_split() with the
+    # default splitter, then a second 1024/200 character pass.
+    first_pass = RecursiveCharacterTextSplitter().split_documents(documents)
+    return RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=200, add_start_index=True).split_documents(first_pass)
+
+
+def measure(name, split, documents, repeat=5):
+    chunks = split(documents)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        split(documents)
+    elapsed = (time.perf_counter() - started) / repeat
+
+    source_chars = sum(len(document.page_content) for document in documents)
+    chunk_chars = sum(len(chunk.page_content) for chunk in chunks)
+    tokens = [estimate_tokens(chunk.page_content) for chunk in chunks]
+    print(f"{name:<22} chunks={len(chunks):>6}  embedded_chars={chunk_chars:>9} ({chunk_chars / source_chars:.2f}x source)  "
+          f"tokens/chunk avg={sum(tokens) / len(tokens):6.1f} max={max(tokens):4d}  "
+          f"throughput={source_chars / elapsed / 1e6:6.2f} MB/s")
+    return len(chunks)
+
+
+def main(paths):
+    documents = load_corpus(paths)
+    print(f"{len(documents)} documents, {sum(len(d.page_content) for d in documents)} characters from {', '.join(paths)}")
+    baseline = measure("double split 1024/200", double_split, documents)
+    single = measure("structured 256/0", StructuredChunker(256, 0).split_documents, documents)
+    measure("structured 256/32", StructuredChunker(256, 32).split_documents, documents)
+    print(f"chunks to label and embed: {single / baseline:.0%} of the old path")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or ["scraped_content_3.txt", "output.json"])
@@ -0,0 +1,60 @@
+"""Size of the PASSAGE block sent to Gemini: joined chunks vs. ContextPacker.
+
+Chunks of the scraped pages in output.json are retrieved with the local
+BM25 index (no API key needed) and the top k are assembled both ways.
+Run from the repository root:
+
+    python -m benchmarks.context_packing [k] [max_tokens]
+"""
+import sys
+import time
+
+from benchmarks.chunking import double_split, load_corpus
+from chunker import StructuredChunker, estimate_tokens
+from context_packer import ContextPacker
+from lexical_index import LexicalIndex
+
+QUERIES = [
+    "NPTEL online certification courses",
+    "admission process and eligibility",
+    "placement statistics and recruiters",
+    "hostel and canteen facilities",
+    "fee structure for engineering",
+    "research and development cell",
+    "anti ragging committee members",
+    "library timings and resources",
+    "scholarships for students",
+    "industry collaboration and MoU",
+]
+
+
+def measure(name, chunks, k, packer):
+    index = LexicalIndex()
+    index.add(chunks, [str(i) for i in range(len(chunks))])
+    joined_tokens = packed_tokens = 0
+    pack_time = 0.0
+    for query in QUERIES:
+        docs = [document for document, _ in index.search(query, k)[0]]
+        joined_tokens += estimate_tokens("\n\n".join(doc.page_content for doc in docs))
+        started = time.perf_counter()
+        packed = packer.pack(docs)
+        pack_time += time.perf_counter() - started
+        packed_tokens += estimate_tokens(packed)
+    print(f"{name:<24} joined={joined_tokens / len(QUERIES):7.0f} tokens  packed={packed_tokens / len(QUERIES):7.0f} tokens "
+          f"({packed_tokens / joined_tokens:.0%})  pack={pack_time / len(QUERIES) * 1000:.2f} ms")
+
+
+def main(k, max_tokens):
+    documents = load_corpus(["output.json"])
+    packer = ContextPacker(max_tokens=max_tokens)
+    print(f"top {k} chunks per query, budget {max_tokens} tokens, {len(QUERIES)} queries")
+    measure("double split 1024/200", double_split(documents), k, packer)
+    measure("structured 256/32", StructuredChunker(256, 32).split_documents(documents), k, packer)
+    measure("structured 256/0", StructuredChunker(256, 0).split_documents(documents), k, packer)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 5,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1500,
+    )
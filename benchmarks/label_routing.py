@@ -0,0 +1,99 @@
+"""Recall and latency of label-routed vector search against a full collection search.
+
+Chunks are synthetic vectors drawn around one centre per label, so the
+exact nearest neighbours are known. Run from the repository root:
+
+    python -m benchmarks.label_routing [chunks] [labels] [queries]
+"""
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import benchmarks._offline  # noqa: F401
+import retriever
+
+DIMENSIONS = 128
+
+
+class TableEmbeddings(Embeddings):
+    def __init__(self):
+        self.vectors = {}
+
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text]
+
+
+def build(chunks, labels, queries, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(labels, DIMENSIONS))
+    assignment = rng.integers(labels, size=chunks)
+    vectors = centres[assignment] + rng.normal(scale=0.8, size=(chunks, DIMENSIONS))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = centres[rng.integers(labels, size=queries)] + rng.normal(scale=0.8, size=(queries, DIMENSIONS))
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return vectors, assignment, query_vectors
+
+
+def search(search_one, query_vectors, k):
+    started = time.perf_counter()
+    results = [[document.id for document in search_one(vector.tolist(), k)] for vector in query_vectors]
+    return results, (time.perf_counter() - started) / len(query_vectors) * 1000
+
+
+def where_filtered(rag):
+    def search_one(vector, k):
+        labels = rag.label_index.route(vector)
+        return rag.vectorstore.similarity_search_by_vector(vector, k, filter={"label": {"$in": labels}})
+    return search_one
+
+
+def recall(results, exact):
+    return np.mean([len(set(found) & set(truth)) / len(truth) for found, truth in zip(results, exact)])
+
+
+def main(chunks, labels, queries, k=5):
+    vectors, assignment, query_vectors = build(chunks, labels, queries)
+    ids = [f"chunk-{i}" for i in range(chunks)]
+    exact = [[ids[i] for i in np.argsort(-(vectors @ query))[:k]] for query in query_vectors]
+
+    rag = retriever.CustomerRAG("bench")
+    rag.chroma_persist_dir = tempfile.mkdtemp()
+    rag.embeddings = embeddings = TableEmbeddings()
+    # The label index is only maintained while routing is on.
+    rag.label_routing_min_chunks = 1
+    embeddings.vectors.update((f"text {i}", vector.tolist()) for i, vector in enumerate(vectors))
+    started = time.perf_counter()
+    for i in range(0, chunks, 1000):
+        rag.add_chunks(
+            [Document(page_content=f"text {j}", metadata={"label": f"topic {assignment[j]}", "source": "bench"}) for j in range(i, min(i + 1000, chunks))],
+            ids[i:i + 1000],
+        )
+    print(f"{chunks} chunks, {labels} labels, {queries} queries; indexed in {time.perf_counter() - started:.1f} s")
+
+    rag.label_routing_min_chunks = 0
+    full, full_ms = search(rag.vector_search, query_vectors, k)
+    rag.label_routing_min_chunks = 1
+    routed, routed_ms = search(rag.vector_search, query_vectors, k)
+    where, where_ms = search(where_filtered(rag), query_vectors, k)
+    searched = np.mean([
+        sum(int(np.sum(assignment == int(label.split()[-1]))) for label in rag.label_index.route(vector) or [f"topic {n}" for n in range(labels)])
+        for vector in query_vectors
+    ]) / chunks
+    print(f"full search    recall@{k}={recall(full, exact):.3f}  {full_ms:6.2f} ms/query")
+    print(f"label routed   recall@{k}={recall(routed, exact):.3f}  {routed_ms:6.2f} ms/query  ({searched:.1%} of the collection searched)")
+    print(f"  as a where filter         {recall(where, exact):.3f}  {where_ms:6.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 40,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 200,
+    )
@@ -0,0 +1,57 @@
+"""Recall, latency and memory of quantized candidate search in ArrayVectorStore.
+
+Vectors are synthetic 768-dimensional embeddings in tight clusters, so
+many chunks score within quantization error of each other; exact float32
+cosine search is the ground truth. Run from the repository root:
+
+    python -m benchmarks.quantization [chunks] [queries]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from vector_store import ArrayVectorStore
+
+DIMENSIONS = 768
+MODES = [(None, 1), ("int8", 1), ("int8", 2), ("int8", 4)]
+
+
+def build(chunks, queries, clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, DIMENSIONS))
+    vectors = centres[rng.integers(clusters, size=chunks)] + rng.normal(scale=0.3, size=(chunks, DIMENSIONS))
+    query_vectors = centres[rng.integers(clusters, size=queries)] + rng.normal(scale=0.3, size=(queries, DIMENSIONS))
+    return vectors.astype(np.float32), query_vectors.astype(np.float32)
+
+
+def main(chunks, queries, k=5):
+    vectors, query_vectors = build(chunks, queries)
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    exact = [set(np.argsort(-(unit @ query))[:k]) for query in query_vectors]
+
+    directory = tempfile.mkdtemp()
+    store = ArrayVectorStore(directory, None, hnsw_threshold=chunks + 1)
+    ids = [str(i) for i in range(chunks)]
+    for start in range(0, chunks, 1000):
+        store.add_vectors(vectors[start:start + 1000], ids[start:start + 1000], [{}] * len(ids[start:start + 1000]), ids[start:start + 1000])
+    disk = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print(f"{chunks} chunks, {queries} queries; {disk / 1024 / 1024:.1f} MB on disk")
+
+    for quantization, rerank_factor in MODES:
+        store = ArrayVectorStore(directory, None, hnsw_threshold=chunks + 1, quantization=quantization, rerank_factor=rerank_factor)
+        started = time.perf_counter()
+        found = [store.similarity_search_by_vector(query, k) for query in query_vectors]
+        query_ms = (time.perf_counter() - started) / queries * 1000
+        recall = np.mean([len({int(document.id) for document in documents} & truth) / k for documents, truth in zip(found, exact)])
+        name = f"{quantization or 'float32'}" + (f", re-rank {rerank_factor}k" if quantization else "")
+        print(f"{name:<20} recall@{k}={recall:.3f}  {query_ms:6.2f} ms/query  in memory {store.memory_bytes() / 1024 / 1024:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+    )
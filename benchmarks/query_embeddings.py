@@ -0,0 +1,65 @@
+"""Remote embedding calls for concurrent chat queries: one call per query vs. LRU + micro-batching.
+
+A fake remote model with fixed latency stands in for Gemini. Run from the
+repository root:
+
+    python -m benchmarks.query_embeddings [concurrent_queries] [distinct_queries] [latency_ms]
+"""
+import asyncio
+import sys
+import time
+
+from embedding_cache import HashingEmbeddings
+from query_embeddings import BatchedQueryEmbeddings, LRUQueryEmbeddings, QueryEmbeddingLRU
+
+
+class RemoteEmbeddings(HashingEmbeddings):
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    def embed_documents(self, texts, task_type=None):
+        return super().embed_documents(texts)
+
+    async def aembed_documents(self, texts, task_type=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return self.embed_query(text)
+
+
+async def measure(name, embeddings, remote, queries):
+    started = time.perf_counter()
+    await asyncio.gather(*(embeddings.aembed_query(query) for query in queries))
+    elapsed = time.perf_counter() - started
+    print(f"{name:<28} remote calls={remote.calls:>4}  wall={elapsed * 1000:7.1f} ms")
+
+
+async def main(concurrent, distinct, latency):
+    queries = [f"question number {i % distinct}" for i in range(concurrent)]
+    print(f"{concurrent} concurrent queries, {distinct} distinct, {latency * 1000:.0f} ms per remote call")
+
+    remote = RemoteEmbeddings(latency)
+    await measure("one call per query", remote, remote, queries)
+
+    remote = RemoteEmbeddings(latency)
+    await measure("micro-batched", BatchedQueryEmbeddings(remote), remote, queries)
+
+    remote = RemoteEmbeddings(latency)
+    cached = LRUQueryEmbeddings(BatchedQueryEmbeddings(remote), QueryEmbeddingLRU(), model="bench")
+    await measure("LRU + micro-batched (cold)", cached, remote, queries)
+    remote.calls = 0
+    await measure("LRU + micro-batched (warm)", cached, remote, queries)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+        float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.1,
+    ))
@@ -0,0 +1,59 @@
+"""Import-time breakdown of the API server, from ``python -X importtime``.
+
+Each run imports the module in a fresh interpreter; the slowest top-level
+packages (self time summed over all their submodules) and the slowest
+imports (cumulative time) are reported for the median run. Run from the
+repository root:
+
+    python -m benchmarks.startup [module] [runs] [top]
+"""
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def import_times(module):
+    env = {**os.environ, "GOOGLE_API_KEY2": os.environ.get("GOOGLE_API_KEY2", "offline-benchmark")}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), len(name) - len(name.lstrip()), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main(module, runs, top):
+    samples = [import_times(module) for _ in range(runs)]
+    totals = [next(cumulative for name, _, _, cumulative in rows if name == module) for rows in samples]
+    rows = samples[totals.index(statistics.median_low(totals))]
+    print(f"import {module}: median {statistics.median_low(totals) / 1000:.0f} ms over {runs} runs "
+          f"(min {min(totals) / 1000:.0f} ms, max {max(totals) / 1000:.0f} ms)")
+
+    packages = defaultdict(int)
+    for name, _, self_us, _ in rows:
+        packages[name.split(".")[0]] += self_us
+    print(f"\nslowest packages (self time of all their modules):")
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+    # Direct imports of the measured module and of its own imports, two levels deep.
+    depth = next(indent for name, indent, _, _ in rows if name == module)
+    print(f"\nslowest imports (cumulative):")
+    nested = [row for row in rows if depth < row[1] <= depth + 4]
+    for name, indent, _, cumulative_us in sorted(nested, key=lambda row: -row[3])[:top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {' ' * (indent - depth - 2)}{name}")
+
+
+if __name__ == "__main__":
+    main(
+        sys.argv[1] if len(sys.argv) > 1 else "app",
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 15,
+    )
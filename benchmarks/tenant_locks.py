@@ -0,0 +1,161 @@
+"""Stress test of per-tenant dataset and index coordination, with and without the locks.
+
+FAQ: many threads add entries to one customer's FAQ file while a reader
+keeps parsing it; lost entries are additions overwritten by a concurrent
+read-modify-write, torn reads are parses of a half-written file.
+
+Index: writer threads add and delete batches of chunks in one customer's
+index while reader threads search it. A consistent snapshot has the same
+chunks in the vector store, the lexical index and, when label routing is
+on, the label index. Run from the repository root:
+
+    python -m benchmarks.tenant_locks [threads] [operations per thread]
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from benchmarks._offline import offline_customer, sample_texts
+from langchain_core.documents import Document
+
+
+class NoLock:
+    def read(self):
+        return nullcontext()
+
+    exclusive = writing = files = read
+
+
+def naive_add_faq_entry(customer_id, question, answer):
+    # The endpoint before per-tenant locks: plain read-modify-write, written in place.
+    faq_file_path = os.path.join(f"Dataset_customer{customer_id}", f"faq_{customer_id}.json")
+    os.makedirs(os.path.dirname(faq_file_path), exist_ok=True)
+    faq_data = {}
+    if os.path.exists(faq_file_path):
+        with open(faq_file_path, "r", encoding="utf-8") as faq_file:
+            faq_data = json.load(faq_file)
+    faq_data[question] = answer
+    with open(faq_file_path, "w", encoding="utf-8") as faq_file:
+        json.dump(faq_data, faq_file, indent=4)
+
+
+def run_threads(threads, target):
+    workers = [threading.Thread(target=target, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def faq(add, customer_id, threads, operations):
+    faq_file_path = os.path.join(f"Dataset_customer{customer_id}", f"faq_{customer_id}.json")
+    errors, torn, done = [0], [0], threading.Event()
+
+    def writer(n):
+        for i in range(operations):
+            try:
+                add(customer_id, f"question {n}-{i}", "answer " * 20)
+            except (ValueError, OSError):
+                errors[0] += 1
+
+    def reader():
+        while not done.is_set():
+            try:
+                with open(faq_file_path, "r", encoding="utf-8") as f:
+                    json.load(f)
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                torn[0] += 1
+
+    watcher = threading.Thread(target=reader)
+    watcher.start()
+    started = time.perf_counter()
+    run_threads(threads, writer)
+    elapsed = time.perf_counter() - started
+    done.set()
+    watcher.join()
+    with open(faq_file_path, "r", encoding="utf-8") as f:
+        stored = len(json.load(f))
+    return threads * operations - stored, torn[0], errors[0], elapsed
+
+
+def index(rag, texts, threads, operations, batch=20):
+    embeddings = [rag.embeddings.embed_query(text) for text in texts[:50]]
+    latencies, inconsistent, errors, done = [], [0], [0], threading.Event()
+
+    def writer(n):
+        for i in range(operations):
+            ids = [f"w{n}-{i}-{j}" for j in range(batch)]
+            documents = [Document(page_content=texts[(n * batch + j) % len(texts)], metadata={"label": f"topic {j % 5}"}) for j in range(batch)]
+            try:
+                rag.add_chunks(documents, ids)
+                rag.delete_chunks(ids)
+            except Exception:
+                errors[0] += 1
+
+    def reader(n):
+        i = 0
+        while not done.is_set():
+            started = time.perf_counter()
+            try:
+                rag.vector_search(embeddings[i % len(embeddings)], 5)
+            except Exception:
+                errors[0] += 1
+            latencies.append(time.perf_counter() - started)
+            i += 1
+
+    def checker():
+        while not done.is_set():
+            with rag.lock.read():
+                sizes = {len(rag.vectorstore.get(include=[])["ids"]), len(rag.lexical_index)}
+                if rag.label_routing_min_chunks:
+                    sizes.add(len(rag.label_index))
+            if len(sizes) > 1:
+                inconsistent[0] += 1
+            time.sleep(0.001)
+
+    readers = [threading.Thread(target=reader, args=(n,)) for n in range(threads)] + [threading.Thread(target=checker)]
+    for thread in readers:
+        thread.start()
+    started = time.perf_counter()
+    run_threads(threads, writer)
+    elapsed = time.perf_counter() - started
+    done.set()
+    for thread in readers:
+        thread.join()
+    latencies = np.array(latencies) * 1000
+    return inconsistent[0], errors[0], len(latencies), np.percentile(latencies, 50), np.percentile(latencies, 99), elapsed
+
+
+def main(threads, operations):
+    import app
+
+    texts = sample_texts(500)
+    # The FAQ files are written relative to the working directory, as the endpoint does.
+    os.chdir(tempfile.mkdtemp())
+    print(f"{threads} writer threads x {operations} operations")
+    for name, add, customer_id in [("unlocked", naive_add_faq_entry, "faq-unlocked"), ("locked", app.add_faq_entry, "faq-locked")]:
+        lost, torn, errors, elapsed = faq(add, customer_id, threads, operations)
+        print(f"faq   {name:<9} lost entries={lost:<5} torn reads={torn:<5} errors={errors:<4} {elapsed:6.2f} s")
+
+    for name, customer_id in [("unlocked", "index-unlocked"), ("locked", "index-locked")]:
+        rag = offline_customer(customer_id, texts)
+        if name == "unlocked":
+            rag.lock = NoLock()
+        inconsistent, errors, searches, p50, p99, elapsed = index(rag, texts, threads, operations)
+        print(f"index {name:<9} inconsistent snapshots={inconsistent:<4} errors={errors:<4} "
+              f"searches={searches:<6} p50={p50:6.2f} ms  p99={p99:6.2f} ms  writes {elapsed:6.2f} s")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 25,
+    )
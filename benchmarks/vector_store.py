@@ -0,0 +1,121 @@
+"""Open time, query latency and memory of the Chroma and array vector store backends.
+
+A number of tenants with synthetic vectors are written with each backend;
+each backend is then measured in a fresh interpreter that opens every
+tenant's store and searches it, so RSS growth is per-tenant overhead rather
+than import cost. Run from the repository root:
+
+    python -m benchmarks.vector_store [chunks per tenant] [tenants] [queries]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from vector_store import open_vector_store
+
+DIMENSIONS = 768
+BACKENDS = ["chroma", "array"]
+
+
+class NoEmbeddings(Embeddings):
+    # Vectors are passed in directly; the stores only need an embedding function to exist.
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def write(backend, directory, vectors):
+    store = open_vector_store(directory, NoEmbeddings(), backend)
+    ids = [f"chunk-{i}" for i in range(len(vectors))]
+    texts = [f"text {i}" for i in range(len(vectors))]
+    metadatas = [{"label": f"topic {i % 10}"} for i in range(len(vectors))]
+    for start in range(0, len(vectors), 1000):
+        end = start + 1000
+        if backend == "array":
+            store.add_vectors(vectors[start:end], texts[start:end], metadatas[start:end], ids[start:end])
+        else:
+            store._collection.upsert(ids=ids[start:end], embeddings=vectors[start:end], documents=texts[start:end], metadatas=metadatas[start:end])
+    close = getattr(getattr(store, "_client", store), "close", None)
+    if close is not None:
+        close()
+
+
+def measure(backend, workdir, tenants):
+    # Runs in its own interpreter: imports are done before the baseline RSS is taken.
+    import chromadb  # noqa: F401
+    from langchain_chroma import Chroma  # noqa: F401
+
+    queries = np.load(os.path.join(workdir, "queries.npy"))
+    baseline = rss_bytes()
+    stores, open_ms, first_ms = [], 0.0, 0.0
+    for tenant in range(tenants):
+        started = time.perf_counter()
+        store = open_vector_store(os.path.join(workdir, backend, str(tenant)), NoEmbeddings(), backend)
+        open_ms += (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        store.similarity_search_by_vector(queries[0].tolist(), 5)
+        first_ms += (time.perf_counter() - started) * 1000
+        stores.append(store)
+
+    started = time.perf_counter()
+    results = []
+    for i, query in enumerate(queries):
+        results.append([document.id for document in stores[i % tenants].similarity_search_by_vector(query.tolist(), 5)])
+    query_ms = (time.perf_counter() - started) / len(queries) * 1000
+    print(json.dumps({
+        "open_ms": open_ms / tenants,
+        "first_query_ms": first_ms / tenants,
+        "query_ms": query_ms,
+        "rss_per_tenant_mb": (rss_bytes() - baseline) / tenants / 1024 / 1024,
+        "results": results,
+    }))
+
+
+def main(chunks, tenants, queries):
+    rng = np.random.default_rng(0)
+    workdir = tempfile.mkdtemp()
+    vectors = rng.normal(size=(chunks, DIMENSIONS)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = vectors[rng.integers(chunks, size=queries)] + rng.normal(scale=0.02, size=(queries, DIMENSIONS)).astype(np.float32)
+    np.save(os.path.join(workdir, "queries.npy"), query_vectors)
+    exact = [[f"chunk-{i}" for i in np.argsort(-(vectors @ query))[:5]] for query in query_vectors]
+
+    print(f"{tenants} tenants x {chunks} chunks of {DIMENSIONS} dimensions, {queries} queries")
+    for backend in BACKENDS:
+        started = time.perf_counter()
+        for tenant in range(tenants):
+            write(backend, os.path.join(workdir, backend, str(tenant)), vectors)
+        write_s = time.perf_counter() - started
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.vector_store", "--measure", backend, workdir, str(tenants)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        recall = np.mean([len(set(found) & set(truth)) / 5 for found, truth in zip(result["results"], exact)])
+        print(f"{backend:<7} write={write_s / tenants * 1000:7.1f} ms  open={result['open_ms']:6.2f} ms  "
+              f"first query={result['first_query_ms']:6.2f} ms  query={result['query_ms']:5.2f} ms  "
+              f"recall@5={recall:.3f}  rss={result['rss_per_tenant_mb']:5.1f} MB/tenant")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 200,
+        )
@@ -0,0 +1,35 @@
+import threading
+
+
+class ChainCache:
+    """Per-customer cache of compiled chains, rebuilt when the dataset version changes."""
+
+    def __init__(self):
+        self._chains = {}
+        self._build_locks = {}
+        self._lock = threading.Lock()
+
+    def cached(self, customer_id, version):
+        entry = self._chains.get(customer_id)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return None
+
+    def get(self, customer_id, version, build):
+        chain = self.cached(customer_id, version)
+        if chain is not None:
+            return chain
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(customer_id, threading.Lock())
+        # Concurrent first requests for one customer build the chain once; other customers are not blocked.
+        with build_lock:
+            chain = self.cached(customer_id, version)
+            if chain is not None:
+                return chain
+            chain = build()
+            self._chains[customer_id] = (version, chain)
+            return chain
+
+    def invalidate(self, customer_id):
+        self._chains.pop(customer_id, None)
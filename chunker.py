@@ -0,0 +1,137 @@
+import re
+from typing import Iterable, List
+
+from langchain_core.documents import Document
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+BLOCK_SEPARATOR = re.compile(r"\n[ \t]*\n\s*")
+# Ordered from the coarsest to the finest boundary an oversized unit may be cut at.
+UNIT_SEPARATORS = (re.compile(r"\n"), re.compile(r"(?<=[.!?;])\s+"), re.compile(r"\s+"))
+HEADING_ENDINGS = (".", "!", "?", ",", ";")
+
+
+def estimate_tokens(text):
+    # Word pieces and punctuation are a close enough stand-in for the model's
+    # tokenizer to size chunks without shipping one.
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def _spans(text, start, end, separator):
+    spans = []
+    position = start
+    for match in separator.finditer(text, start, end):
+        if match.start() > position:
+            spans.append((position, match.start()))
+        position = match.end()
+    if position < end:
+        spans.append((position, end))
+    return spans
+
+
+def _is_heading(block):
+    if block.startswith("#"):
+        return True
+    if "\n" in block or block.endswith(HEADING_ENDINGS):
+        return False
+    return len(block.split()) <= 12
+
+
+class _Unit:
+    __slots__ = ("start", "end", "tokens", "heading")
+
+    def __init__(self, start, end, tokens, heading=False):
+        self.start = start
+        self.end = end
+        self.tokens = tokens
+        self.heading = heading
+
+
+class StructuredChunker:
+    """Single-pass, token-aware chunker that cuts at structural boundaries.
+
+    Text is split into paragraphs first, and a paragraph that is too large
+    is cut at line (table/spreadsheet row), sentence and finally word
+    boundaries. Units are then packed greedily up to ``chunk_size``
+    tokens. A heading always starts a new chunk once the current one is
+    half full and is never left dangling at the end of a chunk. Every
+    chunk is an exact slice of the source text, and its offset is stored
+    as ``start_index``.
+    """
+
+    def __init__(self, chunk_size=256, chunk_overlap=0):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        chunks = []
+        for document in documents:
+            for start, text in self.split_text(document.page_content):
+                metadata = dict(document.metadata)
+                metadata["start_index"] = start
+                chunks.append(Document(page_content=text, metadata=metadata))
+        return chunks
+
+    def split_text(self, text):
+        units = self._units(text)
+        chunks = []
+        current, tokens = [], 0
+        for unit in units:
+            starts_section = unit.heading and tokens >= self.chunk_size // 2
+            if current and (tokens + unit.tokens > self.chunk_size or starts_section):
+                carried = []
+                while current and current[-1].heading:
+                    carried.insert(0, current.pop())
+                if sum(carried_unit.tokens for carried_unit in carried) + unit.tokens > self.chunk_size:
+                    # The next unit fills a chunk on its own, so the heading stays where it was.
+                    current, carried = current + carried, []
+                if current:
+                    chunks.append(self._emit(text, current))
+                    overlap = self._overlap(current)
+                    if sum(overlap_unit.tokens for overlap_unit in overlap + carried) + unit.tokens <= self.chunk_size:
+                        carried = overlap + carried
+                current, tokens = carried, sum(carried_unit.tokens for carried_unit in carried)
+            current.append(unit)
+            tokens += unit.tokens
+        if current:
+            chunks.append(self._emit(text, current))
+        return chunks
+
+    def _overlap(self, units):
+        carried, tokens = [], 0
+        for unit in reversed(units[1:]):
+            if tokens + unit.tokens > self.chunk_overlap:
+                break
+            carried.insert(0, unit)
+            tokens += unit.tokens
+        return carried
+
+    def _emit(self, text, units):
+        start, end = units[0].start, units[-1].end
+        return start, text[start:end]
+
+    def _units(self, text):
+        units = []
+        for start, end in _spans(text, 0, len(text), BLOCK_SEPARATOR):
+            block = text[start:end].strip()
+            if not block:
+                continue
+            # Keep offsets pointing at the stripped block.
+            start += len(text[start:end]) - len(text[start:end].lstrip())
+            end = start + len(block)
+            units.extend(self._fit(text, start, end, _is_heading(block)))
+        return units
+
+    def _fit(self, text, start, end, heading=False, level=0):
+        tokens = estimate_tokens(text[start:end])
+        if tokens <= self.chunk_size:
+            return [_Unit(start, end, tokens, heading)]
+        for depth in range(level, len(UNIT_SEPARATORS)):
+            spans = _spans(text, start, end, UNIT_SEPARATORS[depth])
+            if len(spans) > 1:
+                return [unit for span_start, span_end in spans for unit in self._fit(text, span_start, span_end, level=depth + 1)]
+        # A single run of characters with no whitespace left to cut at.
+        width = max(1, (end - start) * self.chunk_size // tokens)
+        return [_Unit(position, min(position + width, end), estimate_tokens(text[position:min(position + width, end)]))
+                for position in range(start, end, width)]
@@ -0,0 +1,106 @@
+import re
+
+from chunker import StructuredChunker, estimate_tokens
+
+PASSAGE_SEPARATOR = "\n\n"
+# Metadata that identifies the text a start_index is an offset into.
+LOCATION_KEYS = ("source", "page", "page_number")
+
+
+def _normalize_line(line):
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def _shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+class _Passage:
+    __slots__ = ("rank", "start", "end", "text")
+
+    def __init__(self, rank, start, text):
+        self.rank = rank
+        self.start = start
+        self.end = start + len(text) if start is not None else None
+        self.text = text
+
+
+class ContextPacker:
+    """Turns retrieved chunks into the PASSAGE block: merged, de-duplicated and cut to a token budget.
+
+    Chunks from the same source whose ``start_index`` spans overlap or touch
+    are merged back into one passage. Lines already emitted by a
+    better-ranked passage (navigation, footers and other scraped
+    boilerplate) are dropped, as are passages that are near-duplicates of
+    one already kept. Passages are then added in retrieval order until
+    ``max_tokens`` is reached; the last one is cut at a structural boundary
+    if enough room is left for it to be useful.
+    """
+
+    def __init__(self, max_tokens=1500, duplicate_threshold=0.8, min_tail_tokens=48, max_gap=2):
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.min_tail_tokens = min_tail_tokens
+        self.max_gap = max_gap
+
+    def __call__(self, docs):
+        return self.pack(docs)
+
+    def pack(self, docs):
+        passages = self._merge(docs)
+        kept, seen_lines, kept_shingles = [], set(), []
+        budget = self.max_tokens
+        for passage in passages:
+            lines = [line for line in passage.text.split("\n") if _normalize_line(line) not in seen_lines]
+            text = "\n".join(lines).strip()
+            if not text:
+                continue
+            shingles = _shingles(text)
+            if any(len(shingles & other) / len(shingles | other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+
+            tokens = estimate_tokens(text)
+            if tokens > budget:
+                if budget < self.min_tail_tokens:
+                    break
+                text = StructuredChunker(budget, 0).split_text(text)[0][1]
+                tokens = estimate_tokens(text)
+            kept.append(text)
+            kept_shingles.append(shingles)
+            seen_lines.update(_normalize_line(line) for line in lines if line.strip())
+            budget -= tokens
+            if budget <= 0:
+                break
+        return PASSAGE_SEPARATOR.join(kept)
+
+    def _merge(self, docs):
+        located, unlocated = {}, []
+        for rank, doc in enumerate(docs):
+            start = doc.metadata.get("start_index")
+            location = tuple(doc.metadata.get(key) for key in LOCATION_KEYS)
+            if start is None or location[0] is None:
+                unlocated.append(_Passage(rank, None, doc.page_content))
+            else:
+                located.setdefault(location, []).append(_Passage(rank, start, doc.page_content))
+
+        merged = list(unlocated)
+        for passages in located.values():
+            passages.sort(key=lambda passage: passage.start)
+            current = passages[0]
+            for passage in passages[1:]:
+                overlap = current.end - passage.start
+                if passage.end <= current.end:
+                    pass  # Already covered by the current span.
+                elif 0 < overlap and current.text.endswith(passage.text[:overlap]):
+                    current.text += passage.text[overlap:]
+                elif -self.max_gap <= overlap <= 0:
+                    current.text += "\n" + passage.text
+                else:
+                    merged.append(current)
+                    current = passage
+                    continue
+                current.end = max(current.end, passage.end)
+                current.rank = min(current.rank, passage.rank)
+            merged.append(current)
+        return sorted(merged, key=lambda passage: passage.rank)
@@ -0,0 +1,187 @@
+import array
+import asyncio
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from manifest import content_hash
+
+SQLITE_MAX_VARIABLES = 500
+
+
+class EmbeddingCache:
+    def __init__(self, path, max_entries=200_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._entries = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (model, hash))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self._conn
+
+    def get_many(self, model, hashes):
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(hashes), SQLITE_MAX_VARIABLES):
+                batch = hashes[i:i + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = _unpack(blob)
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, digest) for digest in found],
+                )
+                conn.commit()
+        return found
+
+    def put_many(self, model, items):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(model, digest, _pack(vector), now) for digest, vector in items],
+            )
+            self._entries += max(cursor.rowcount, 0)
+            if self._entries > self.max_entries:
+                # Evict down to 90% so a full cache does not evict on every insert.
+                excess = self._entries - int(self.max_entries * 0.9)
+                conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._entries -= excess
+            conn.commit()
+
+    def record(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._entries,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes, found, missing = self._lookup(self.model, texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            found.update(self._store(self.model, missing, vectors))
+        return [found[digest] for digest in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        model = f"{self.model}:query"
+        hashes, found, missing = self._lookup(model, [text])
+        if missing:
+            found.update(self._store(model, missing, [self.embeddings.embed_query(text)]))
+        return found[hashes[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # The SQLite reads and committed writes block, and may wait on an ingestion's batch, so they stay off the event loop.
+        hashes, found, missing = await asyncio.to_thread(self._lookup, self.model, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            found.update(await asyncio.to_thread(self._store, self.model, missing, vectors))
+        return [found[digest] for digest in hashes]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        model = f"{self.model}:query"
+        hashes, found, missing = await asyncio.to_thread(self._lookup, model, [text])
+        if missing:
+            vector = await self.embeddings.aembed_query(text)
+            found.update(await asyncio.to_thread(self._store, model, missing, [vector]))
+        return found[hashes[0]]
+
+    def _lookup(self, model, texts):
+        hashes = [content_hash(text) for text in texts]
+        unique = list(dict.fromkeys(hashes))
+        found = self.cache.get_many(model, unique)
+        missing = {digest: text for digest, text in zip(hashes, texts) if digest not in found}
+        self.cache.record(hits=sum(1 for digest in hashes if digest in found), misses=len(missing))
+        return hashes, found, missing
+
+    def _store(self, model, missing, vectors):
+        items = list(zip(missing, vectors))
+        self.cache.put_many(model, items)
+        return dict(items)
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic, offline stand-in for a remote embedding model.
+
+    Tokens are hashed into a fixed number of signed buckets, so texts that
+    share words end up close together and identical texts always map to
+    the same vector.
+    """
+
+    def __init__(self, size=768):
+        self.size = size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.size
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+
+def _pack(vector):
+    return array.array("f", vector).tobytes()
+
+
+def _unpack(blob):
+    vector = array.array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+embedding_cache = EmbeddingCache(os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3"))
@@ -0,0 +1,141 @@
+import os
+import re
+import shutil
+import threading
+import weakref
+from contextlib import contextmanager
+
+ACTIVE_FILE = "ACTIVE"
+_VERSION = re.compile(r"^version-(\d+)$")
+
+
+class IndexVersions:
+    """Versioned index directories under one tenant root, switched by an ACTIVE pointer file.
+
+    A rebuild writes a new ``version-N`` directory next to the live one and
+    ``activate`` points ACTIVE at it with a single rename, so a crash leaves
+    either the old or the new version active, never a half-built one. A
+    root without ACTIVE that holds an index written before versioning is
+    itself the active version.
+
+    Readers wrap their use of a version's store in ``reading()``. A version
+    replaced by ``retire`` is closed and deleted only once every reader that
+    started before the swap has finished, so a search never loses its store
+    mid-query and never waits on a rebuild.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._readers = {}
+        self._retired = []
+
+    def active(self):
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE), "r", encoding="utf-8") as f:
+                return os.path.join(self.root, f.read().strip())
+        except FileNotFoundError:
+            return self.root
+
+    def create(self):
+        """A new, empty version directory, not yet active."""
+        os.makedirs(self.root, exist_ok=True)
+        numbers = [int(match.group(1)) for match in map(_VERSION.match, os.listdir(self.root)) if match]
+        path = os.path.join(self.root, f"version-{max(numbers, default=0) + 1}")
+        os.makedirs(path)
+        return path
+
+    def activate(self, path):
+        pointer = os.path.join(self.root, ACTIVE_FILE)
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(os.path.basename(path))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + ".tmp", pointer)
+
+    @contextmanager
+    def reading(self):
+        with self._lock:
+            epoch = self._epoch
+            self._readers[epoch] = self._readers.get(epoch, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._readers[epoch] -= 1
+                if not self._readers[epoch]:
+                    del self._readers[epoch]
+                retired = self._collectable()
+            self._remove(retired)
+
+    def retire(self, path, close=None):
+        """Close and delete a replaced version once no reader can still be using it."""
+        with self._lock:
+            self._retired.append((self._epoch, path, close))
+            self._epoch += 1
+            retired = self._collectable()
+        self._remove(retired)
+
+    def _collectable(self):
+        # Readers from epoch e may use any version still active at e; one retired at epoch r is safe once all readers are past r.
+        oldest_reader = min(self._readers, default=self._epoch)
+        ready = [entry for entry in self._retired if entry[0] < oldest_reader]
+        self._retired = [entry for entry in self._retired if entry[0] >= oldest_reader]
+        return ready
+
+    def _remove(self, retired):
+        for _, path, close in retired:
+            if close is not None:
+                close()
+            self.discard(path)
+
+    def discard(self, path):
+        path = os.path.normpath(path)
+        root = os.path.normpath(self.root)
+        if os.path.dirname(path) != root and path != root:
+            return  # Not one of this tenant's versions.
+        if path == root:
+            # An index from before versioning: everything in the root except the versions themselves.
+            for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+                if name != ACTIVE_FILE and not _VERSION.match(name):
+                    _delete(os.path.join(self.root, name))
+        else:
+            _delete(path)
+
+    def collect(self):
+        """Delete version directories that are neither active nor waiting on readers, e.g. from an interrupted build."""
+        if not os.path.isdir(self.root):
+            return
+        active = os.path.normpath(self.active())
+        with self._lock:
+            pending = {os.path.normpath(path) for _, path, _ in self._retired}
+        for name in os.listdir(self.root):
+            path = os.path.normpath(os.path.join(self.root, name))
+            if _VERSION.match(name) and path != active and path not in pending:
+                _delete(path)
+
+
+class TenantIndexVersions:
+    def __init__(self):
+        # One IndexVersions per root, shared by every CustomerRAG loaded for it, so reader epochs and retired
+        # versions survive a tenant being evicted and reloaded while a search or a build is still running.
+        self._versions = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, root):
+        with self._lock:
+            versions = self._versions.get(root)
+            if versions is None:
+                versions = self._versions[root] = IndexVersions(root)
+            return versions
+
+
+tenant_index_versions = TenantIndexVersions()
+
+
+def _delete(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,137 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class IngestionProgress:
+    def set_total(self, count):
+        pass
+
+    def advance(self, stage, count=1):
+        pass
+
+    def check_cancelled(self):
+        pass
+
+
+class IngestionJob(IngestionProgress):
+    STAGES = ("parsed", "labeled", "embedded")
+
+    def __init__(self, customer_id, directory):
+        self.id = uuid.uuid4().hex
+        self.customer_id = customer_id
+        self.directory = directory
+        self.status = "queued"
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.total = None
+        self.counters = {stage: 0 for stage in self.STAGES}
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def set_total(self, count):
+        with self._lock:
+            self.total = count
+
+    def advance(self, stage, count=1):
+        self.check_cancelled()
+        with self._lock:
+            self.counters[stage] += count
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def cancel(self):
+        self._cancel.set()
+
+    def to_dict(self):
+        with self._lock:
+            counters = dict(self.counters)
+            total = self.total
+        elapsed = None
+        throughput = {}
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            throughput = {f"{stage}_per_second": counters[stage] / elapsed if elapsed else 0.0 for stage in self.STAGES}
+        return {
+            "job_id": self.id,
+            "customer_id": self.customer_id,
+            "directory": self.directory,
+            "status": self.status,
+            "error": self.error,
+            "progress": {"chunks": total, **counters},
+            "throughput": throughput,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_seconds": elapsed,
+        }
+
+
+class IngestionQueue:
+    def __init__(self, run, max_workers=2, max_finished_jobs=500):
+        self._run = run
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self._max_finished_jobs = max_finished_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, customer_id, directory):
+        job = IngestionJob(customer_id, directory)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._execute, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, customer_id=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if customer_id is None or job.customer_id == customer_id]
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        with self._lock:
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = time.time()
+        return job
+
+    def _execute(self, job):
+        with self._lock:
+            if job.status != "queued":
+                return
+            job.status = "running"
+            job.started_at = time.time()
+        try:
+            self._run(job.customer_id, job.directory, job)
+            job.status = "succeeded"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            print(f"Ingestion job {job.id} for customer {job.customer_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - self._max_finished_jobs)]:
+            del self._jobs[job_id]
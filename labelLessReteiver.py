@@ -1,12 +1,10 @@
-from langchain_community.document_loaders import (
-    PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader, UnstructuredMarkdownLoader, 
-    UnstructuredExcelLoader, UnstructuredPowerPointLoader, UnstructuredCSVLoader, UnstructuredEPubLoader
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
 import os
+from chunker import StructuredChunker
+from embedding_cache import CachedEmbeddings, embedding_cache
+from parsing import parse_files, supported_files
 
 load_dotenv()
 
@@ -15,8 +13,14 @@ class CustomerRAG:
         self.customer_id = customer_id
         self.chroma_persist_dir = f"label_less_chroma_db_customer{customer_id}"
         self.dataset_dir = f"Dataset_customer{customer_id}"
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=os.environ["GOOGLE_API_KEY2"])
+        self.embeddings = CachedEmbeddings(
+            GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=os.environ["GOOGLE_API_KEY2"]),
+            embedding_cache,
+            model="models/embedding-001",
+        )
         self.vectorstore = None
+        self.dataset_version = 0
+        self.chunker = StructuredChunker(chunk_size=256, chunk_overlap=0)
 
     def get_retriever(self):
         if not self.vectorstore:
@@ -28,60 +32,35 @@ class CustomerRAG:
         return self.vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 5})
 
     def load_documents(self):
-        loaders = {
-            ".pdf": PyPDFLoader,
-            ".txt": TextLoader,
-            ".docx": UnstructuredWordDocumentLoader,
-            ".md": UnstructuredMarkdownLoader,
-            ".xlsx": UnstructuredExcelLoader,
-            ".pptx": UnstructuredPowerPointLoader,
-            ".csv": UnstructuredCSVLoader,
-            ".epub": UnstructuredEPubLoader,
-        }
+        documents = self.parse_directory(self.dataset_dir)
 
-        documents = []
-        for file in os.listdir(self.dataset_dir):
-            file_path = os.path.join(self.dataset_dir, file)
-            file_extension = os.path.splitext(file)[1].lower()
-            if file_extension in loaders:
-                loader = loaders[file_extension](file_path)
-                documents.extend(loader.load_and_split())
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=200, add_start_index=True)
-        texts = text_splitter.split_documents(documents)
+        texts = self.chunker.split_documents(documents)
 
         if not self.vectorstore:
             self.vectorstore = Chroma(persist_directory=self.chroma_persist_dir, embedding_function=self.embeddings)
         
         self.vectorstore.add_documents(texts)
+        self.dataset_version += 1
+
+    def parse_directory(self, directory):
+        documents = []
+        for file_path, file_documents, error in parse_files(supported_files(directory)):
+            if error:
+                print(f"Failed to parse {file_path} for customer {self.customer_id}: {error}")
+                continue
+            documents.extend(file_documents)
+        return documents
 
     def update_document_set(self, new_directory):
-        loaders = {
-            ".pdf": PyPDFLoader,
-            ".txt": TextLoader,
-            ".docx": UnstructuredWordDocumentLoader,
-            ".md": UnstructuredMarkdownLoader,
-            ".xlsx": UnstructuredExcelLoader,
-            ".pptx": UnstructuredPowerPointLoader,
-            ".csv": UnstructuredCSVLoader,
-            ".epub": UnstructuredEPubLoader,
-        }
-
-        new_documents = []
-        for file in os.listdir(new_directory):
-            file_path = os.path.join(new_directory, file)
-            file_extension = os.path.splitext(file)[1].lower()
-            if file_extension in loaders:
-                loader = loaders[file_extension](file_path)
-                new_documents.extend(loader.load())
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=200, add_start_index=True)
-        new_texts = text_splitter.split_documents(new_documents)
+        new_documents = self.parse_directory(new_directory)
+
+        new_texts = self.chunker.split_documents(new_documents)
 
         if not self.vectorstore:
             self.vectorstore = Chroma(persist_directory=self.chroma_persist_dir, embedding_function=self.embeddings)
         
         self.vectorstore.add_documents(new_texts)
+        self.dataset_version += 1
         print(f"Added {len(new_texts)} new document chunks to the database for customer {self.customer_id}.")
 
 class RAGChatbotManager:
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+import threading
+import time
+
+SQLITE_MAX_VARIABLES = 500
+
+
+class LabelCache:
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS labels ("
+                "hash TEXT NOT NULL, prompt_version TEXT NOT NULL, label TEXT NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (hash, prompt_version))"
+            )
+        return self._conn
+
+    def get_many(self, hashes, prompt_version):
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(hashes), SQLITE_MAX_VARIABLES):
+                batch = hashes[i:i + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT hash, label FROM labels WHERE prompt_version = ? AND hash IN ({placeholders})",
+                    [prompt_version, *batch],
+                ).fetchall()
+                found.update(rows)
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, items, prompt_version):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO labels (hash, prompt_version, label, created) VALUES (?, ?, ?, ?)",
+                [(digest, prompt_version, label, now) for digest, label in items],
+            )
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+label_cache = LabelCache(os.getenv("LABEL_CACHE_PATH", "label_cache.sqlite3"))
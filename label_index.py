@@ -0,0 +1,101 @@
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+UNLABELED = "Unlabeled"
+
+
+class LabelIndex:
+    """Label -> chunk ids, with a centroid embedding per label, for routing queries to the relevant part of a collection."""
+
+    def __init__(self, top_labels=3, min_candidates=20):
+        self.top_labels = top_labels
+        self.min_candidates = min_candidates
+        self._labels = {}
+        self._members = defaultdict(set)
+        self._sums = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        # Number of indexed chunks.
+        return len(self._labels)
+
+    def add(self, ids, labels, vectors):
+        with self._lock:
+            for chunk_id, label, vector in zip(ids, labels, vectors):
+                if chunk_id in self._labels:
+                    continue
+                label = label or UNLABELED
+                vector = _unit(vector)
+                self._labels[chunk_id] = label
+                self._members[label].add(chunk_id)
+                self._sums[label] = self._sums[label] + vector if label in self._sums else vector
+
+    def remove(self, ids, vectors):
+        with self._lock:
+            for chunk_id, vector in zip(ids, vectors):
+                label = self._labels.pop(chunk_id, None)
+                if label is None:
+                    continue
+                self._members[label].discard(chunk_id)
+                if self._members[label]:
+                    self._sums[label] = self._sums[label] - _unit(vector)
+                else:
+                    del self._members[label]
+                    del self._sums[label]
+
+    def route(self, query_vector):
+        """The labels worth searching for a query, or None when the whole collection should be searched.
+
+        Labels are taken in order of centroid similarity: at least top_labels of
+        them, and more until they hold min_candidates chunks. Unlabeled chunks
+        have no meaningful centroid, so they are always included.
+        """
+        query = _unit(query_vector)
+        with self._lock:
+            labels = [label for label in self._sums if label != UNLABELED]
+            if len(labels) <= self.top_labels:
+                return None
+            centroids = np.stack([self._sums[label] for label in labels])
+            norms = np.linalg.norm(centroids, axis=1)
+            scores = centroids @ query / np.where(norms > 0, norms, 1)
+            selected, candidates = [], 0
+            for i in np.argsort(-scores):
+                if len(selected) >= self.top_labels and candidates >= self.min_candidates:
+                    break
+                selected.append(labels[i])
+                candidates += len(self._members[labels[i]])
+            if candidates >= len(self._labels) - len(self._members.get(UNLABELED, ())):
+                return None
+            if UNLABELED in self._members:
+                selected.append(UNLABELED)
+            return selected
+
+    @property
+    def dimensions(self):
+        sums = list(self._sums.values())[:1]
+        return len(sums[0]) if sums else 0
+
+    def memory_bytes(self):
+        # Centroid sums plus roughly 100 bytes of dict/set overhead per indexed chunk.
+        return len(self._sums) * self.dimensions * 4 + 100 * len(self._labels)
+
+    def members(self, labels):
+        with self._lock:
+            return [chunk_id for label in labels for chunk_id in self._members.get(label, ())]
+
+    def stats(self):
+        with self._lock:
+            sizes = [len(members) for members in self._members.values()]
+            return {
+                "labels": len(self._members),
+                "chunks": len(self._labels),
+                "largest_label": max(sizes, default=0),
+            }
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,179 @@
+import asyncio
+import os
+import random
+import re
+from typing import Callable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain.prompts import PromptTemplate
+
+from async_utils import run_sync
+from manifest import content_hash
+
+# Bump whenever either prompt changes so cached labels are not reused across prompts.
+LABEL_PROMPT_VERSION = "1"
+
+labeling_prompt = PromptTemplate(
+    input_variables=["text"],
+    template="Given the following text, provide a short label (1-2 words) that best describes its main topic or content:\n\n{text}\n\nLabel:"
+)
+
+batch_labeling_prompt = PromptTemplate(
+    input_variables=["count", "passages"],
+    template="Below are {count} numbered passages. For each passage, provide a short label (1-2 words) that best describes its main topic or content.\n"
+             "Answer with exactly {count} lines of the form \"<number>: <label>\", one per passage, in order, and nothing else.\n\n"
+             "{passages}\n\nLabels:"
+)
+
+BATCH_PROMPT_OVERHEAD_TOKENS = 80
+LABEL_LINE = re.compile(r"^\s*\[?(\d+)\s*[\]\).:-]\s*(.+?)\s*$")
+
+
+def estimate_tokens(text):
+    return len(text.split()) + 50
+
+
+def format_passages(texts):
+    return "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(texts, start=1))
+
+
+def parse_batch_labels(output, count):
+    labels = {}
+    for line in output.splitlines():
+        match = LABEL_LINE.match(line)
+        if match:
+            label = match.group(2).strip().strip("\"'*").strip()
+            if label:
+                labels[int(match.group(1))] = label
+    if sorted(labels) != list(range(1, count + 1)):
+        return None
+    return [labels[i] for i in range(1, count + 1)]
+
+
+class DocumentLabeler:
+    def __init__(self, rate_limiter, tenant="default", max_concurrency=4, max_retries=5, base_wait_time=1, model=None,
+                 batch_size=10, max_batch_tokens=4000, label_cache=None):
+        self.rate_limiter = rate_limiter
+        self.tenant = tenant
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_wait_time = base_wait_time
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.label_cache = label_cache
+        if model is None:
+            # Imported here so that importing this module does not pull in the Gemini client.
+            from langchain_google_genai import ChatGoogleGenerativeAI
+
+            model = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=os.environ["GOOGLE_API_KEY2"], temperature=0.2)
+        self.model = model
+        self.labeling_chain = labeling_prompt | self.model | StrOutputParser()
+        self.batch_labeling_chain = batch_labeling_prompt | self.model | StrOutputParser()
+
+    def label_documents(self, documents: List[Document], progress: Optional[Callable[[int, int], None]] = None) -> List[Document]:
+        return run_sync(self.alabel_documents(documents, progress))
+
+    async def alabel_documents(self, documents: List[Document], progress: Optional[Callable[[int, int], None]] = None) -> List[Document]:
+        total = len(documents)
+        done = 0
+
+        by_hash = {}
+        for doc in documents:
+            digest = doc.metadata.get("chunk_hash") or content_hash(doc.page_content)
+            by_hash.setdefault(digest, []).append(doc)
+
+        cached = self.label_cache.get_many(list(by_hash), LABEL_PROMPT_VERSION) if self.label_cache else {}
+        for digest, label in cached.items():
+            for doc in by_hash.pop(digest):
+                doc.metadata["label"] = label
+                done += 1
+        if cached:
+            print(f"Reused cached labels for {done}/{total} documents")
+            if progress:
+                progress(done, total)
+
+        # Identical chunks only need to be labeled once.
+        pending = [docs[0] for docs in by_hash.values()]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _label(batch):
+            nonlocal done
+            async with semaphore:
+                labels = await self._label_batch([doc.page_content for doc in batch])
+            fresh = []
+            for doc, label in zip(batch, labels):
+                digest = doc.metadata.get("chunk_hash") or content_hash(doc.page_content)
+                for duplicate in by_hash[digest]:
+                    duplicate.metadata["label"] = label
+                    done += 1
+                if label != "Unlabeled":
+                    fresh.append((digest, label))
+            if self.label_cache and fresh:
+                self.label_cache.put_many(fresh, LABEL_PROMPT_VERSION)
+            print(f"Labeled {done}/{total} documents: {', '.join(labels)}")
+            if progress:
+                progress(done, total)
+
+        await asyncio.gather(*(_label(batch) for batch in self.plan_batches(pending)))
+        return documents
+
+    def batch_token_budget(self):
+        # Keep every in-flight batch inside one minute of the shared token budget.
+        return max(1, min(self.max_batch_tokens, self.rate_limiter.max_tokens_per_minute // self.max_concurrency))
+
+    def plan_batches(self, documents):
+        budget = self.batch_token_budget()
+        batches = []
+        batch, batch_tokens = [], BATCH_PROMPT_OVERHEAD_TOKENS
+        for doc in documents:
+            tokens = estimate_tokens(doc.page_content)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > budget):
+                batches.append(batch)
+                batch, batch_tokens = [], BATCH_PROMPT_OVERHEAD_TOKENS
+            batch.append(doc)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _label_batch(self, texts):
+        if len(texts) == 1:
+            return [await self._label_text(texts[0])]
+
+        tokens = BATCH_PROMPT_OVERHEAD_TOKENS + sum(estimate_tokens(text) for text in texts)
+        output = await self._invoke_with_retries(
+            self.batch_labeling_chain,
+            {"count": len(texts), "passages": format_passages(texts)},
+            tokens,
+        )
+        if output is None:
+            return ["Unlabeled"] * len(texts)
+
+        labels = parse_batch_labels(output, len(texts))
+        if labels is None:
+            print(f"Malformed labels for a batch of {len(texts)} documents, retrying in smaller batches...")
+            middle = len(texts) // 2
+            return await self._label_batch(texts[:middle]) + await self._label_batch(texts[middle:])
+        return labels
+
+    async def _label_text(self, text):
+        label = await self._invoke_with_retries(self.labeling_chain, text, estimate_tokens(text))
+        return label.strip() if label is not None else "Unlabeled"
+
+    async def _invoke_with_retries(self, chain, inputs, tokens):
+        retries = self.max_retries
+        while retries > 0:
+            try:
+                await self.rate_limiter.acquire(tokens, self.tenant)
+                return await chain.ainvoke(inputs)
+            except Exception as e:
+                print(f"Error labeling document: {e}")
+                retries -= 1
+                if retries > 0:
+                    wait_time = self.base_wait_time * (2 ** (self.max_retries - retries)) + random.uniform(0, 1)
+                    print(f"Retrying in {wait_time:.2f} seconds...")
+                    await asyncio.sleep(wait_time)
+
+        print(f"Failed to label document after {self.max_retries} attempts. Skipping.")
+        return None
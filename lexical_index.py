@@ -0,0 +1,139 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+
+TOKEN = re.compile(r"\w+(?:[-/.]\w+)*")
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        tokens.append(token)
+        # Codes such as "jee-main" or "ug/2024" also match on their parts.
+        parts = re.findall(r"\w+", token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def identifier_terms(text):
+    """Terms that look like codes or product names: containing digits or separators, or written in capitals."""
+    return {
+        token.lower() for token in TOKEN.findall(text)
+        if any(c.isdigit() for c in token) or re.search(r"[-/.]", token) or (len(token) > 1 and token.isupper())
+    }
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over one customer's chunks, kept in step with the Chroma collection."""
+
+    def __init__(self, k1=1.5, b=0.75, decisive_ratio=1.5, rare_fraction=0.01, rare_min_df=3):
+        self.k1 = k1
+        self.b = b
+        self.decisive_ratio = decisive_ratio
+        self.rare_fraction = rare_fraction
+        self.rare_min_df = rare_min_df
+        self._documents = {}
+        self._lengths = {}
+        self._postings = defaultdict(dict)
+        self._total_length = 0
+        self._text_bytes = 0
+        self._posting_entries = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def add(self, documents, ids):
+        with self._lock:
+            for chunk_id, document in zip(ids, documents):
+                if chunk_id in self._documents:
+                    self._remove(chunk_id)
+                terms = Counter(tokenize(document.page_content))
+                self._documents[chunk_id] = Document(id=chunk_id, page_content=document.page_content, metadata=dict(document.metadata))
+                self._lengths[chunk_id] = sum(terms.values())
+                self._total_length += self._lengths[chunk_id]
+                self._text_bytes += len(document.page_content)
+                self._posting_entries += len(terms)
+                for term, count in terms.items():
+                    self._postings[term][chunk_id] = count
+
+    def remove(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id in self._documents:
+                    self._remove(chunk_id)
+
+    def _remove(self, chunk_id):
+        document = self._documents.pop(chunk_id)
+        self._total_length -= self._lengths.pop(chunk_id)
+        self._text_bytes -= len(document.page_content)
+        terms = set(tokenize(document.page_content))
+        self._posting_entries -= len(terms)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query, k=5):
+        """Return (results, decisive): the top k (document, score) pairs and whether they can stand in for vector search.
+
+        A result set is decisive when the best chunk contains a rare identifier from
+        the query (an exam code, an acronym) and outscores the runner-up by decisive_ratio.
+        """
+        with self._lock:
+            total = len(self._documents)
+            if not total:
+                return [], False
+            average_length = self._total_length / total
+            rare_df = max(self.rare_min_df, self.rare_fraction * total)
+            scores = defaultdict(float)
+            identifiers = identifier_terms(query)
+            rare_hits = defaultdict(int)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / average_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                    if df <= rare_df and term in identifiers:
+                        rare_hits[chunk_id] += 1
+            ranked = heapq.nlargest(max(k, 2), scores.items(), key=lambda item: item[1])
+            results = [(self._documents[chunk_id], score) for chunk_id, score in ranked[:k]]
+
+            decisive = bool(ranked) and rare_hits[ranked[0][0]] > 0 and (
+                len(ranked) == 1 or ranked[0][1] >= self.decisive_ratio * ranked[1][1]
+            )
+            return results, decisive
+
+    def memory_bytes(self):
+        # Rough CPython cost: the chunk text, about 100 bytes per posting entry and 200 per stored document.
+        return self._text_bytes + 100 * self._posting_entries + 200 * len(self._documents)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chunks": len(self._documents),
+                "terms": len(self._postings),
+            }
+
+
+def reciprocal_rank_fusion(rankings, k, constant=60):
+    """Merge ranked document lists by summed 1 / (constant + rank); documents are matched on id."""
+    scores = defaultdict(float)
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            key = document.id or document.page_content
+            scores[key] += 1 / (constant + rank + 1)
+            documents.setdefault(key, document)
+    return [documents[key] for key, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]]
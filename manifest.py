@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_ids(source, texts):
+    # The same passage can legitimately appear twice in one file, so the
+    # occurrence number is part of the ID to keep them distinct but stable.
+    source = os.path.normpath(source)
+    occurrences = {}
+    ids = []
+    for text in texts:
+        digest = content_hash(text)
+        occurrence = occurrences.get(digest, 0)
+        occurrences[digest] = occurrence + 1
+        ids.append(hashlib.sha256(f"{source}\0{digest}\0{occurrence}".encode("utf-8")).hexdigest()[:32])
+    return ids
+
+
+class IngestManifest:
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.files = json.load(f)["files"]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.files = {}
+
+    def changed_files(self, paths):
+        changed = []
+        for path in paths:
+            digest = file_hash(path)
+            entry = self.files.get(os.path.normpath(path))
+            if entry is None or entry["hash"] != digest:
+                changed.append((path, digest))
+        return changed
+
+    def removed_files(self, directory, paths):
+        directory = os.path.normpath(directory)
+        present = {os.path.normpath(path) for path in paths}
+        return [path for path in self.files if os.path.dirname(path) == directory and path not in present]
+
+    def chunk_ids(self, path):
+        entry = self.files.get(os.path.normpath(path))
+        return set(entry["chunks"]) if entry else set()
+
+    def record(self, path, digest, ids):
+        self.files[os.path.normpath(path)] = {"hash": digest, "chunks": list(ids)}
+
+    def remove(self, path):
+        self.files.pop(os.path.normpath(path), None)
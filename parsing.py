@@ -0,0 +1,170 @@
+import importlib
+import math
+import multiprocessing
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Loader class names in langchain_community.document_loaders, imported only when a file of that type is parsed.
+LOADERS = {
+    ".pdf": "PyPDFLoader",
+    ".txt": "TextLoader",
+    ".docx": "UnstructuredWordDocumentLoader",
+    ".md": "UnstructuredMarkdownLoader",
+    ".xlsx": "UnstructuredExcelLoader",
+    ".pptx": "UnstructuredPowerPointLoader",
+    ".csv": "UnstructuredCSVLoader",
+    ".epub": "UnstructuredEPubLoader",
+}
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", 0)) or None
+PARSE_TIMEOUT_SECONDS = float(os.getenv("PARSE_TIMEOUT_SECONDS", 300))
+PARSE_MAX_MEMORY_MB = int(os.getenv("PARSE_MAX_MEMORY_MB", 2048))
+# The worker's own alarm gets this long to fire before the parent kills the worker, e.g. when it is stuck in C code.
+PARSE_KILL_GRACE_SECONDS = 5
+
+
+class ParseTimeout(Exception):
+    pass
+
+
+def supported_files(directory):
+    return [
+        os.path.join(directory, file)
+        for file in sorted(os.listdir(directory))
+        if os.path.splitext(file)[1].lower() in LOADERS
+    ]
+
+
+def get_loader(extension):
+    return getattr(importlib.import_module("langchain_community.document_loaders"), LOADERS[extension])
+
+
+def parse_file(file_path, timeout=None):
+    # Runs inside a pool worker, where the main thread is free to take SIGALRM.
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        def _on_timeout(signum, frame):
+            raise ParseTimeout(f"Parsing {file_path} took longer than {timeout} seconds")
+
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.alarm(max(1, math.ceil(timeout)))
+    try:
+        loader = get_loader(os.path.splitext(file_path)[1].lower())(file_path)
+        return loader.load()
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+
+
+def _limit_memory(max_memory_mb):
+    if max_memory_mb and resource is not None:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def parse_files(file_paths, max_workers=PARSE_WORKERS, timeout=PARSE_TIMEOUT_SECONDS, max_memory_mb=PARSE_MAX_MEMORY_MB):
+    """Yield ``(file_path, documents, error)`` for each file as soon as it is parsed.
+
+    Files are parsed in separate processes so the CPU-heavy Unstructured
+    loaders use every core. A file that raises, times out or kills its
+    worker is yielded with an error and the rest carry on: a worker that
+    dies takes the pool down with it, so the pool is rebuilt and the files
+    that were in flight are retried one at a time to find the one to blame,
+    and a worker still busy past the timeout is killed from here.
+    """
+    if not file_paths:
+        return
+
+    workers = min(max_workers or os.cpu_count() or 1, len(file_paths))
+    remaining = deque(file_paths)
+    # Files that were in flight when a worker died; each is retried alone, so a second death identifies it.
+    suspects = deque()
+    pending = {}
+    deadlines = {}
+    executor = None
+
+    def _start():
+        # Spawn rather than fork: the API process runs worker threads, and forking them is unsafe.
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_limit_memory,
+            initargs=(max_memory_mb,),
+        )
+
+    def _submit(file_path):
+        future = executor.submit(parse_file, file_path, timeout)
+        pending[future] = file_path
+        if timeout:
+            deadlines[future] = time.monotonic() + timeout + PARSE_KILL_GRACE_SECONDS
+
+    try:
+        while remaining or suspects or pending:
+            if executor is None:
+                executor = _start()
+            if suspects:
+                if not pending:
+                    _submit(suspects.popleft())
+            else:
+                # One file per worker, so a file's deadline runs from when a worker picks it up and parsed
+                # documents never pile up faster than the caller consumes them.
+                while remaining and len(pending) < workers:
+                    _submit(remaining.popleft())
+
+            wait_for = max(0.0, min(deadlines.values()) - time.monotonic()) if deadlines else None
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            broken, overdue = False, []
+            for future in done:
+                try:
+                    documents = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    continue
+                except Exception as e:
+                    yield pending.pop(future), None, e
+                else:
+                    yield pending.pop(future), documents, None
+                deadlines.pop(future, None)
+            if not broken:
+                now = time.monotonic()
+                overdue = [future for future in pending if future not in done and deadlines.get(future, now + 1) <= now]
+                if not overdue:
+                    continue
+
+            # The pool is unusable: take it down, then decide what happens to each file that was in it.
+            in_flight = list(pending.values())
+            timed_out = {pending[future] for future in overdue}
+            _kill(executor)
+            executor = None
+            pending.clear()
+            deadlines.clear()
+            for file_path in reversed(in_flight):
+                if file_path in timed_out:
+                    yield file_path, None, ParseTimeout(f"Parsing {file_path} took longer than {timeout} seconds")
+                elif timed_out:
+                    # Innocent: only lost its worker when the overdue one was killed.
+                    remaining.appendleft(file_path)
+                elif len(in_flight) == 1:
+                    yield file_path, None, BrokenProcessPool(f"The process parsing {file_path} died, e.g. on the memory limit")
+                else:
+                    suspects.appendleft(file_path)
+    finally:
+        if executor is not None:
+            # Don't block a cancelled ingestion on files nobody is waiting for any more.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _kill(executor):
+    # The executor has no public way to stop a running task; its worker processes are the only handle.
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,144 @@
+import asyncio
+
+from manifest import chunk_ids, content_hash
+from parsing import parse_files
+
+_DONE = object()
+
+
+class _FileState:
+    def __init__(self, path, digest, ids, stale_ids, pending):
+        self.path = path
+        self.digest = digest
+        self.ids = ids
+        self.stale_ids = stale_ids
+        self.pending = pending
+
+
+class IngestionPipeline:
+    """Streams parse -> split -> label -> embed/upsert through bounded queues.
+
+    Only a few micro-batches are alive at any time, and every file is
+    recorded in the manifest as soon as all of its chunks are committed,
+    so memory stays flat and an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, rag, progress, queue_size=4, commit_batch_size=64):
+        self.rag = rag
+        self.progress = progress
+        self.commit_batch_size = commit_batch_size
+        self.label_workers = rag.labeler.max_concurrency
+        self.label_queue = asyncio.Queue(maxsize=queue_size)
+        self.commit_queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = {"new": 0, "stale": 0, "failed_files": 0, "total": 0}
+
+    async def run(self, changed_files, removed_files):
+        tasks = [asyncio.create_task(self._parse(changed_files)), asyncio.create_task(self._commit())]
+        tasks += [asyncio.create_task(self._label()) for _ in range(self.label_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        stale_ids = [chunk_id for file_path in removed_files for chunk_id in self.rag.manifest.chunk_ids(file_path)]
+        if stale_ids:
+            await asyncio.to_thread(self.rag.delete_chunks, stale_ids)
+            self.stats["stale"] += len(stale_ids)
+        for file_path in removed_files:
+            self.rag.manifest.remove(file_path)
+        self.rag.manifest.save()
+        return self.stats
+
+    async def _parse(self, changed_files):
+        files = parse_files(list(changed_files))
+        try:
+            while True:
+                item = await asyncio.to_thread(next, files, None)
+                if item is None:
+                    break
+                self.progress.check_cancelled()
+                file_path, documents, error = item
+                if error:
+                    # Leave the file out of the manifest so the next update retries it.
+                    print(f"Failed to parse {file_path} for customer {self.rag.customer_id}: {error}")
+                    self.stats["failed_files"] += 1
+                    continue
+                await self._split(file_path, changed_files[file_path], documents)
+        finally:
+            if not files.gi_running:
+                files.close()
+
+        for _ in range(self.label_workers):
+            await self.label_queue.put(_DONE)
+
+    async def _split(self, file_path, digest, documents):
+        texts = self.rag.chunker.split_documents(documents)
+        ids = chunk_ids(file_path, [text.page_content for text in texts])
+        known_ids = self.rag.manifest.chunk_ids(file_path)
+        new = [(text, chunk_id) for text, chunk_id in zip(texts, ids) if chunk_id not in known_ids]
+        if new:
+            # Chunks committed by an interrupted earlier run are already in the store.
+            stored = set(await asyncio.to_thread(self.rag.existing_chunk_ids, [chunk_id for _, chunk_id in new]))
+            new = [(text, chunk_id) for text, chunk_id in new if chunk_id not in stored]
+
+        state = _FileState(file_path, digest, ids, known_ids - set(ids), len(new))
+        self.progress.advance("parsed", len(texts))
+        self.stats["total"] += len(new)
+        self.progress.set_total(self.stats["total"])
+        if not new:
+            await self._finish_file(state)
+            return
+
+        batch_size = self.rag.labeler.batch_size
+        for i in range(0, len(new), batch_size):
+            batch = []
+            for text, chunk_id in new[i:i + batch_size]:
+                text.metadata["chunk_hash"] = content_hash(text.page_content)
+                batch.append((text, chunk_id, state))
+            await self.label_queue.put(batch)
+
+    async def _label(self):
+        while True:
+            batch = await self.label_queue.get()
+            if batch is _DONE:
+                await self.commit_queue.put(_DONE)
+                return
+            self.progress.check_cancelled()
+            await self.rag.labeler.alabel_documents([text for text, _, _ in batch])
+            self.progress.advance("labeled", len(batch))
+            await self.commit_queue.put(batch)
+
+    async def _commit(self):
+        pending = []
+        finished_workers = 0
+        while finished_workers < self.label_workers:
+            batch = await self.commit_queue.get()
+            if batch is _DONE:
+                finished_workers += 1
+                continue
+            pending.extend(batch)
+            if len(pending) >= self.commit_batch_size:
+                await self._upsert(pending)
+                pending = []
+        if pending:
+            await self._upsert(pending)
+
+    async def _upsert(self, items):
+        self.progress.check_cancelled()
+        await asyncio.to_thread(self.rag.add_chunks, [text for text, _, _ in items], [chunk_id for _, chunk_id, _ in items])
+        self.progress.advance("embedded", len(items))
+        self.stats["new"] += len(items)
+        for _, _, state in items:
+            state.pending -= 1
+            if state.pending == 0:
+                await self._finish_file(state)
+
+    async def _finish_file(self, state):
+        if state.stale_ids:
+            await asyncio.to_thread(self.rag.delete_chunks, list(state.stale_ids))
+            self.stats["stale"] += len(state.stale_ids)
+        self.rag.manifest.record(state.path, state.digest, state.ids)
+        self.rag.manifest.save()
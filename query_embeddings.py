@@ -0,0 +1,205 @@
+import asyncio
+import inspect
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+QUERY_TASK_TYPE = "RETRIEVAL_QUERY"
+
+
+class QueryEmbeddingLRU:
+    """In-process LRU of query vectors, shared by every tenant that uses the same embedding model."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model, text):
+        with self._lock:
+            vector = self._vectors.get((model, text))
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._vectors.move_to_end((model, text))
+            return vector
+
+    def put(self, model, text, vector):
+        with self._lock:
+            self._vectors[(model, text)] = vector
+            self._vectors.move_to_end((model, text))
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._vectors),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class LRUQueryEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, lru: QueryEmbeddingLRU, model: str):
+        self.embeddings = embeddings
+        self.lru = lru
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.lru.get(self.model, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.lru.put(self.model, text, vector)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self.lru.get(self.model, text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.lru.put(self.model, text, vector)
+        return vector
+
+
+class _Batch:
+    def __init__(self, max_size, make_future, full):
+        self.max_size = max_size
+        self.futures = OrderedDict()
+        self.make_future = make_future
+        self.full = full
+
+    def add(self, text):
+        # Identical queries in one window share a slot and a result.
+        if text not in self.futures:
+            self.futures[text] = self.make_future()
+            if len(self.futures) >= self.max_size:
+                self.full.set()
+        return self.futures[text]
+
+
+class BatchedQueryEmbeddings(Embeddings):
+    """Collects queries that arrive within max_wait_ms of each other into one embed_documents request.
+
+    The first caller in a window leads: it waits for the window to close (or
+    the batch to fill), makes the request and resolves everyone's futures.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size=32, max_wait_ms=5):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batched_queries = 0
+        self._lock = threading.Lock()
+        self._sync_batch = None
+        self._async_batches = {}
+        # Without a task_type argument the batch would be embedded as documents, so fall back to one call per query.
+        parameters = inspect.signature(embeddings.embed_documents).parameters.values()
+        self.supports_task_type = any(p.name == "task_type" or p.kind == p.VAR_KEYWORD for p in parameters)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            batch = self._sync_batch
+            leader = batch is None
+            if leader:
+                batch = self._sync_batch = _Batch(self.max_batch_size, Future, threading.Event())
+            future = batch.add(text)
+            if batch.full.is_set():
+                self._sync_batch = None
+        if leader:
+            batch.full.wait(self.max_wait)
+            with self._lock:
+                if self._sync_batch is batch:
+                    self._sync_batch = None
+            try:
+                self._fulfil(batch, self._embed_batch(list(batch.futures)))
+            except Exception as e:
+                self._fail(batch, e)
+        return future.result()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        batch = self._async_batches.get(loop)
+        if batch is None:
+            batch = self._async_batches[loop] = _Batch(self.max_batch_size, loop.create_future, asyncio.Event())
+            # A separate task flushes the batch, so a cancelled caller cannot strand the others.
+            batch.task = loop.create_task(self._aflush(loop, batch))
+        future = batch.add(text)
+        if batch.full.is_set():
+            self._async_batches.pop(loop, None)
+        return await asyncio.shield(future)
+
+    async def _aflush(self, loop, batch):
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        if self._async_batches.get(loop) is batch:
+            del self._async_batches[loop]
+        try:
+            self._fulfil(batch, await self._aembed_batch(list(batch.futures)))
+        except Exception as e:
+            self._fail(batch, e)
+
+    def _fulfil(self, batch, vectors):
+        for future, vector in zip(batch.futures.values(), vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def _fail(self, batch, error):
+        for future in batch.futures.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _record(self, texts):
+        with self._lock:
+            self.batches += 1
+            self.batched_queries += len(texts)
+
+    def _embed_batch(self, texts):
+        self._record(texts)
+        if len(texts) == 1:
+            return [self.embeddings.embed_query(texts[0])]
+        if self.supports_task_type:
+            return self.embeddings.embed_documents(texts, task_type=QUERY_TASK_TYPE)
+        return [self.embeddings.embed_query(text) for text in texts]
+
+    async def _aembed_batch(self, texts):
+        self._record(texts)
+        if len(texts) == 1:
+            return [await self.embeddings.aembed_query(texts[0])]
+        if self.supports_task_type:
+            return await self.embeddings.aembed_documents(texts, task_type=QUERY_TASK_TYPE)
+        return list(await asyncio.gather(*(self.embeddings.aembed_query(text) for text in texts)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "queries": self.batched_queries,
+                "queries_per_batch": self.batched_queries / self.batches if self.batches else 0.0,
+            }
+
+
+query_embedding_lru = QueryEmbeddingLRU(int(os.getenv("QUERY_EMBEDDING_LRU_SIZE", 4096)))
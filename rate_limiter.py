@@ -0,0 +1,191 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+from query_embeddings import QUERY_TASK_TYPE
+
+
+class _Waiter:
+    __slots__ = ("tokens", "granted")
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.granted = False
+
+
+class TokenBucketLimiter:
+    """Request and token buckets shared by every tenant in the process.
+
+    Waiters queue per tenant and tenants are served round-robin, so one
+    customer's ingestion cannot starve another's. Interactive waiters (chat
+    queries) are served ahead of all bulk ones, and bulk work leaves
+    reserved_share of each bucket untouched, so a query finds budget
+    waiting instead of queueing for the next refill behind an ingestion.
+    Both buckets refill continuously instead of resetting on a fixed window.
+    """
+
+    def __init__(self, max_requests_per_minute, max_tokens_per_minute, reserved_share=0.1, clock=time.monotonic):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        # Bulk work must still be able to take at least one request, and a full-size batch, from a full bucket.
+        self.reserved_requests = min(max_requests_per_minute * reserved_share, max(0.0, max_requests_per_minute - 1))
+        self.reserved_tokens = max_tokens_per_minute * reserved_share
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._requests = float(max_requests_per_minute)
+        self._tokens = float(max_tokens_per_minute)
+        self._last_refill = clock()
+        self._queues = OrderedDict()
+        self._interactive = deque()
+
+    async def acquire(self, tokens=0, tenant="default", interactive=False):
+        waiter = self._enqueue(tokens, tenant, interactive)
+        try:
+            while True:
+                delay = self._poll(waiter)
+                if delay is None:
+                    return
+                await asyncio.sleep(delay)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def wait(self, tokens=0, tenant="default", interactive=False):
+        waiter = self._enqueue(tokens, tenant, interactive)
+        try:
+            while True:
+                delay = self._poll(waiter)
+                if delay is None:
+                    return
+                time.sleep(delay)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def _enqueue(self, tokens, tenant, interactive=False):
+        # A request larger than the whole budget would never fit; let it drain the bucket instead.
+        if interactive:
+            waiter = _Waiter(min(tokens, self.max_tokens_per_minute))
+        else:
+            waiter = _Waiter(min(tokens, self.max_tokens_per_minute - self.reserved_tokens))
+        with self._lock:
+            if interactive:
+                self._interactive.append(waiter)
+            else:
+                self._queues.setdefault(tenant, deque()).append(waiter)
+        return waiter
+
+    def _poll(self, waiter):
+        with self._lock:
+            self._refill(self._clock())
+            self._grant()
+            if waiter.granted:
+                return None
+            return self._delay()
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests = min(self.max_requests_per_minute, self._requests + elapsed * self.max_requests_per_minute / 60)
+        self._tokens = min(self.max_tokens_per_minute, self._tokens + elapsed * self.max_tokens_per_minute / 60)
+
+    def _grant(self):
+        while self._interactive:
+            waiter = self._interactive[0]
+            if self._requests < 1 or self._tokens < waiter.tokens:
+                # Nothing bulk may go ahead of a waiting query.
+                return
+            self._requests -= 1
+            self._tokens -= waiter.tokens
+            waiter.granted = True
+            self._interactive.popleft()
+        while self._queues:
+            tenant, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if self._requests < 1 + self.reserved_requests or self._tokens < waiter.tokens + self.reserved_tokens:
+                return
+            self._requests -= 1
+            self._tokens -= waiter.tokens
+            waiter.granted = True
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+
+    def _delay(self):
+        if self._interactive:
+            requests, tokens = 1, self._interactive[0].tokens
+        else:
+            requests = 1 + self.reserved_requests
+            tokens = next(iter(self._queues.values()))[0].tokens + self.reserved_tokens
+        request_wait = max(0.0, requests - self._requests) * 60 / self.max_requests_per_minute
+        token_wait = max(0.0, tokens - self._tokens) * 60 / self.max_tokens_per_minute
+        return max(request_wait, token_wait, 0.01)
+
+    def _abandon(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                return
+            if waiter in self._interactive:
+                self._interactive.remove(waiter)
+                return
+            for tenant, queue in self._queues.items():
+                if waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[tenant]
+                    return
+
+
+class RateLimitedEmbeddings(Embeddings):
+    def __init__(self, embeddings: Embeddings, rate_limiter: TokenBucketLimiter, tenant="default", batch_size=100):
+        self.embeddings = embeddings
+        self.rate_limiter = rate_limiter
+        self.tenant = tenant
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            self.rate_limiter.wait(_count_tokens(batch), self.tenant, _is_query(kwargs))
+            vectors.extend(self.embeddings.embed_documents(batch, **kwargs))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        self.rate_limiter.wait(_count_tokens([text]), self.tenant, interactive=True)
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            await self.rate_limiter.acquire(_count_tokens(batch), self.tenant, _is_query(kwargs))
+            vectors.extend(await self.embeddings.aembed_documents(batch, **kwargs))
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await self.rate_limiter.acquire(_count_tokens([text]), self.tenant, interactive=True)
+        return await self.embeddings.aembed_query(text)
+
+
+def _is_query(kwargs):
+    # BatchedQueryEmbeddings sends a batch of chat queries as one embed_documents call with the query task type.
+    return kwargs.get("task_type") == QUERY_TASK_TYPE
+
+
+def _count_tokens(texts):
+    return sum(len(text.split()) for text in texts)
+
+
+gemini_limiter = TokenBucketLimiter(
+    max_requests_per_minute=int(os.getenv("GEMINI_MAX_REQUESTS_PER_MINUTE", 10)),
+    max_tokens_per_minute=int(os.getenv("GEMINI_MAX_TOKENS_PER_MINUTE", 10000)),
+    reserved_share=float(os.getenv("GEMINI_INTERACTIVE_RESERVED_SHARE", 0.1)),
+)
@@ -1,8 +1,9 @@
+from operator import itemgetter
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_google_genai import ChatGoogleGenerativeAI
 from retriever import get_retriever, rag_manager
+from chain_cache import ChainCache
 from dotenv import load_dotenv
 import os
 
@@ -30,22 +31,24 @@ ANSWER:
 """
 QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
 
-def generate_response(query, history, customer_id):
-    retriever = get_retriever(customer_id)
+rag_chains = ChainCache()
 
-    def _combine_documents(docs):
-        return format_docs(docs)
-    
-    rag_chain = (
+def build_rag_chain(customer_id):
+    retriever = get_retriever(customer_id)
+    return (
         {
-            "context": lambda x: _combine_documents(retriever.invoke(x["query"])),
-            "query": RunnablePassthrough(),
-            "history": RunnablePassthrough(),
+            "context": itemgetter("query") | retriever | format_docs,
+            "query": itemgetter("query"),
+            "history": itemgetter("history"),
         }
         | QA_CHAIN_PROMPT
         | model
         | StrOutputParser()
     )
+
+def generate_response(query, history, customer_id):
+    customer_rag = rag_manager.get_customer_rag(customer_id)
+    rag_chain = rag_chains.get(customer_id, customer_rag.dataset_version, lambda: build_rag_chain(customer_id))
     result = rag_chain.invoke(input={"query": query, "history": history})
     return result
 
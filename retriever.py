@@ -1,207 +1,510 @@
 
+import asyncio
+import copy
+import functools
+import itertools
+import threading
 import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from operator import itemgetter
 from typing import List
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (
-    PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader, UnstructuredMarkdownLoader, 
-    UnstructuredExcelLoader, UnstructuredPowerPointLoader, UnstructuredCSVLoader, UnstructuredEPubLoader
-)
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-import random
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
 import os
+from answer_cache import answer_caches
+from async_utils import run_sync
+from chain_cache import ChainCache
+from chunker import StructuredChunker
+from context_packer import ContextPacker
+from embedding_cache import CachedEmbeddings, embedding_cache
+from index_versions import tenant_index_versions
+from jobs import IngestionProgress
+from label_cache import label_cache
+from label_index import LabelIndex
+from labeling import DocumentLabeler
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from manifest import IngestManifest
+from parsing import supported_files
+from pipeline import IngestionPipeline
+from query_embeddings import BatchedQueryEmbeddings, LRUQueryEmbeddings, query_embedding_lru
+from rate_limiter import RateLimitedEmbeddings, gemini_limiter
+from tenant_locks import TenantLock, tenant_locks
+from vector_store import VECTOR_STORE_BACKEND, open_vector_store, quantization_for
 
 load_dotenv()
 
-class RateLimiter:
-    def __init__(self, max_requests_per_minute, max_tokens_per_minute):
-        self.max_requests_per_minute = max_requests_per_minute
-        self.max_tokens_per_minute = max_tokens_per_minute
-        self.request_timestamps = []
-        self.token_count = 0
-        self.last_reset = time.time()
+# The Gemini clients and Chroma are imported on first use: together they are most of the import time of app.py
+# (benchmarks/startup.py), and a tenant's first request has to wait for its collection anyway.
+_clients_lock = threading.Lock()
+# One Gemini embedding client for every tenant; per-tenant state lives in the light wrappers around it.
+embedding_client = None
+model = None
+# Size of the vectors models/embedding-001 returns.
+EMBEDDING_DIMENSIONS = 768
 
-    def wait(self, tokens):
-        current_time = time.time()
-        
 
-        if current_time - self.last_reset >= 60:
-            self.request_timestamps = []
-            self.token_count = 0
-            self.last_reset = current_time
-        
+def get_embedding_client():
+    global embedding_client
+    with _clients_lock:
+        if embedding_client is None:
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
-        self.request_timestamps = [ts for ts in self.request_timestamps if current_time - ts < 60]
-        
+            embedding_client = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=os.environ["GOOGLE_API_KEY2"])
+        return embedding_client
 
-        while len(self.request_timestamps) >= self.max_requests_per_minute:
-            time.sleep(1)
-            current_time = time.time()
-            self.request_timestamps = [ts for ts in self.request_timestamps if current_time - ts < 60]
-        
 
-        while self.token_count + tokens > self.max_tokens_per_minute:
-            time.sleep(1)
-            current_time = time.time()
-            if current_time - self.last_reset >= 60:
-                self.token_count = 0
-                self.last_reset = current_time
-        
-        self.request_timestamps.append(current_time)
-        self.token_count += tokens
+def get_model():
+    global model
+    with _clients_lock:
+        if model is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+
+            model = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=os.environ["GOOGLE_API_KEY2"], temperature=0.2)
+        return model
+
+# Versions are unique across CustomerRAG instances, so caches keyed on them stay correct when a tenant is reloaded.
+_dataset_versions = itertools.count()
 
 class CustomerRAG:
-    def __init__(self, customer_id):
+    def __init__(self, customer_id, label_concurrency=4, label_batch_size=10, chunk_size=256, chunk_overlap=0):
         self.customer_id = customer_id
-        self.chroma_persist_dir = f"chroma_db_customer{customer_id}"
+        self.lock = tenant_locks.get(customer_id)
+        self.index_versions = tenant_index_versions.get(f"chroma_db_customer{customer_id}")
         self.dataset_dir = f"Dataset_customer{customer_id}"
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=os.environ["GOOGLE_API_KEY2"])
+        self.rate_limiter = gemini_limiter
+        self.embeddings = LRUQueryEmbeddings(
+            CachedEmbeddings(
+                BatchedQueryEmbeddings(
+                    RateLimitedEmbeddings(
+                        get_embedding_client(),
+                        self.rate_limiter,
+                        tenant=customer_id,
+                    ),
+                    max_wait_ms=float(os.getenv("QUERY_BATCH_WAIT_MS", 5)),
+                ),
+                embedding_cache,
+                model="models/embedding-001",
+            ),
+            query_embedding_lru,
+            model="models/embedding-001",
+        )
+        self.vector_backend = VECTOR_STORE_BACKEND
+        self.vector_quantization = quantization_for(customer_id)
+        self._reset_index(self.index_versions.active())
+        # Build a tenant's first index, and full rebuilds, into a new index version and swap it in when complete,
+        # instead of writing into the live one. Dataset updates are incremental and always applied in place.
+        self.shadow_builds = os.getenv("INDEX_SHADOW_BUILDS", "1") != "0"
+        self._open_lock = threading.Lock()
+        self._cold_start_lock = threading.Lock()
+        self._cold_start = None
+        # 0 turns routing off: against Chroma's HNSW index a restricted search is slower than a full one
+        # (benchmarks/label_routing.py), so it only pays off for stores that scan their candidates.
+        self.label_routing_min_chunks = int(os.getenv("LABEL_ROUTING_MIN_CHUNKS", 0))
+        self.retrieval_counts = {"lexical": 0, "hybrid": 0, "routed": 0}
+        self.dataset_version = next(_dataset_versions)
+        self.chunker = StructuredChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.labeler = DocumentLabeler(
+            self.rate_limiter,
+            tenant=customer_id,
+            max_concurrency=label_concurrency,
+            batch_size=label_batch_size,
+            model=get_model(),
+            label_cache=label_cache,
+        )
+
+    def _reset_index(self, persist_dir):
+        # Everything that belongs to one version of the index.
+        self.chroma_persist_dir = persist_dir
         self.vectorstore = None
-        self.batch_size = 7
-        self.delay = 45
-        self.rate_limiter = RateLimiter(max_requests_per_minute=10, max_tokens_per_minute=10000)
+        self.lexical_index = LexicalIndex(decisive_ratio=float(os.getenv("LEXICAL_DECISIVE_RATIO", 1.5)))
+        self.label_index = LabelIndex(top_labels=int(os.getenv("LABEL_ROUTING_TOP_LABELS", 3)))
+        self.manifest = IngestManifest(os.path.join(persist_dir, "ingest_manifest.json"))
 
-    def get_retriever(self):
+    def load_index(self):
         if not self.vectorstore:
-            self.vectorstore = Chroma(persist_directory=self.chroma_persist_dir, embedding_function=self.embeddings)
+            self.open_vectorstore()
             
-            if self.vectorstore._collection.count() == 0:
-                self.load_documents()
+            # Opening loads every stored chunk into the lexical index, so its size is the collection's.
+            if len(self.lexical_index) == 0:
+                if self.shadow_builds:
+                    # Queries are answered from the empty index until the first version is swapped in.
+                    self.start_cold_start()
+                else:
+                    self.load_documents()
         
-        return self.vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 5})
-
-    def load_documents(self):
-        loaders = {
-            ".pdf": PyPDFLoader,
-            ".txt": TextLoader,
-            ".docx": UnstructuredWordDocumentLoader,
-            ".md": UnstructuredMarkdownLoader,
-            ".xlsx": UnstructuredExcelLoader,
-            ".pptx": UnstructuredPowerPointLoader,
-            ".csv": UnstructuredCSVLoader,
-            ".epub": UnstructuredEPubLoader,
-        }
+        return self.vectorstore
+
+    def start_cold_start(self):
+        # Not the build lock: a request must not wait for a rebuild that is already running.
+        with self._cold_start_lock:
+            if self._cold_start is None and os.path.isdir(self.dataset_dir):
+                self._cold_start = threading.Thread(target=self._run_cold_start, daemon=True)
+                self._cold_start.start()
+
+    def building(self):
+        """Whether a background cold start is running; the manager must not evict the tenant under it."""
+        return self._cold_start is not None
+
+    def _run_cold_start(self):
+        try:
+            self.load_documents()
+        except Exception as e:
+            print(f"Failed to build the index for customer {self.customer_id}: {e}")
+        finally:
+            self._cold_start = None
 
-        documents = []
-        for file in os.listdir(self.dataset_dir):
-            file_path = os.path.join(self.dataset_dir, file)
-            file_extension = os.path.splitext(file)[1].lower()
-            if file_extension in loaders:
-                loader = loaders[file_extension](file_path)
-                documents.extend(loader.load_and_split())
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=200, add_start_index=True)
-        texts = text_splitter.split_documents(documents)
-
-        labeled_texts = self.label_documents(texts)
-        if not self.vectorstore:
-            self.vectorstore = Chroma(persist_directory=self.chroma_persist_dir, embedding_function=self.embeddings)
-        
-        self.vectorstore.add_documents(labeled_texts)
-
-    def label_documents(self, documents: List[Document]) -> List[Document]:
+    def get_retriever(self):
+        return RunnableLambda(self.retrieve, afunc=self.aretrieve)
+
+    def lexical_search(self, query, k=5):
+        results, decisive = self.lexical_index.search(query, k)
+        return [document for document, _ in results], decisive
+
+    def retrieve(self, query, k=5):
+        self.load_index()
+        lexical, decisive = self.lexical_search(query, k * 2)
+        if decisive:
+            self.retrieval_counts["lexical"] += 1
+            return lexical[:k]
+        self.retrieval_counts["hybrid"] += 1
+        vector = self.vector_search(self.embeddings.embed_query(query), k * 2)
+        return reciprocal_rank_fusion([lexical, vector], k)
+
+    async def aretrieve(self, query, k=5):
+        self.load_index()
+        lexical, decisive = self.lexical_search(query, k * 2)
+        if decisive:
+            self.retrieval_counts["lexical"] += 1
+            return lexical[:k]
+        self.retrieval_counts["hybrid"] += 1
+        embedding = await self.embeddings.aembed_query(query)
+        # Neither vector store has an async search, so only the local query runs on a worker thread.
+        vector = await asyncio.to_thread(self.vector_search, embedding, k * 2)
+        return reciprocal_rank_fusion([lexical, vector], k)
+
+    def vector_search(self, embedding, k=5):
+        # The read lock keeps an in-place batch from landing between routing and search.
+        with self.lock.read(), self.index_versions.reading():
+            labels = None
+            if self.label_routing_min_chunks and len(self.label_index) >= self.label_routing_min_chunks:
+                labels = self.label_index.route(embedding)
+            if labels is None:
+                return self.vectorstore.similarity_search_by_vector(embedding, k)
+            self.retrieval_counts["routed"] += 1
+            # Restricting by id is several times cheaper in Chroma than the equivalent {"label": {"$in": labels}} filter.
+            return self.vectorstore.similarity_search_by_vector(embedding, k, ids=self.label_index.members(labels))
+
+    def query_embedding(self, query):
+        """The query's embedding, or None when the lexical fast path will answer it without one."""
+        if self.lexical_search(query)[1]:
+            return None
+        return self.embeddings.embed_query(query)
+
+    async def aquery_embedding(self, query):
+        if self.lexical_search(query)[1]:
+            return None
+        return await self.embeddings.aembed_query(query)
+
+    def load_documents(self, progress=None):
+        if self.shadow_builds:
+            self.rebuild([self.dataset_dir], progress)
+            return
+        with self.lock.writing():
+            # An empty collection means nothing in the manifest is actually stored.
+            self.manifest.clear()
+            self.update_document_set(self.dataset_dir, progress)
+
+    def label_documents(self, documents: List[Document], progress=None) -> List[Document]:
         print(f"Labeling {len(documents)} documents for customer {self.customer_id}...")
-        labeling_prompt = PromptTemplate(
-            input_variables=["text"],
-            template="Given the following text, provide a short label (1-2 words) that best describes its main topic or content:\n\n{text}\n\nLabel:"
-        )
-        model = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=os.environ["GOOGLE_API_KEY2"], temperature=0.2)
-        labeling_chain = labeling_prompt | model | StrOutputParser()
-
-        labeled_documents = []
-        for i in range(0, len(documents), self.batch_size):
-            batch = documents[i:i+self.batch_size]
-            print(f"Processing batch {i//self.batch_size + 1} of {len(documents)//self.batch_size + 1}")
-            
-            for doc in batch:
-                retries = 5
-                base_wait_time = 1
-                while retries > 0:
-                    try:
-                        estimated_tokens = len(doc.page_content.split()) + 50
-                        self.rate_limiter.wait(estimated_tokens)
-                        
-                        label = labeling_chain.invoke(doc.page_content).strip()
-                        doc.metadata["label"] = label
-                        labeled_documents.append(doc)
-                        break
-                    except Exception as e:
-                        print(f"Error labeling document: {e}")
-                        retries -= 1
-                        if retries > 0:
-                            wait_time = base_wait_time * (2 ** (5 - retries)) + random.uniform(0, 1)
-                            print(f"Retrying in {wait_time:.2f} seconds...")
-                            time.sleep(wait_time)
-                        else:
-                            print(f"Failed to label document after 5 attempts. Skipping.")
-                            doc.metadata["label"] = "Unlabeled"
-                            labeled_documents.append(doc)
-                    else:
-                        #guess who's back
-                        print(f"Successfully labeled document: {label}")
-
-            if i + self.batch_size < len(documents):
-                print(f"Waiting for {self.delay} seconds before processing next batch...")
-                time.sleep(self.delay)
-        
-        return labeled_documents
-    
-
-    def update_document_set(self, new_directory):
-        loaders = {
-            ".pdf": PyPDFLoader,
-            ".txt": TextLoader,
-            ".docx": UnstructuredWordDocumentLoader,
-            ".md": UnstructuredMarkdownLoader,
-            ".xlsx": UnstructuredExcelLoader,
-            ".pptx": UnstructuredPowerPointLoader,
-            ".csv": UnstructuredCSVLoader,
-            ".epub": UnstructuredEPubLoader,
-        }
-
-        new_documents = []
-        for file in os.listdir(new_directory):
-            file_path = os.path.join(new_directory, file)
-            file_extension = os.path.splitext(file)[1].lower()
-            if file_extension in loaders:
-                loader = loaders[file_extension](file_path)
-                new_documents.extend(loader.load())
+        return self.labeler.label_documents(documents, progress)
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1024, chunk_overlap=200, add_start_index=True)
-        new_texts = text_splitter.split_documents(new_documents)
-
-        labeled_texts = self.label_documents(new_texts)
+    def open_vectorstore(self):
         if not self.vectorstore:
-            self.vectorstore = Chroma(persist_directory=self.chroma_persist_dir, embedding_function=self.embeddings)
-        
-        self.vectorstore.add_documents(labeled_texts)
-        print(f"Added {len(labeled_texts)} new document chunks to the database for customer {self.customer_id}.")
+            with self._open_lock:
+                if not self.vectorstore:
+                    vectorstore = open_vector_store(
+                        self.chroma_persist_dir, self.embeddings, self.vector_backend, self.vector_quantization
+                    )
+                    # The lexical and label indexes live in memory only, so they are rebuilt from the collection on first open.
+                    # Reading every embedding back is most of the cost of opening a Chroma collection, and only routing needs them.
+                    routing = bool(self.label_routing_min_chunks)
+                    stored = vectorstore.get(include=["documents", "metadatas", "embeddings"] if routing else ["documents", "metadatas"])
+                    metadatas = [metadata or {} for metadata in stored["metadatas"]]
+                    self.lexical_index.add(
+                        [Document(page_content=text, metadata=metadata) for text, metadata in zip(stored["documents"], metadatas)],
+                        stored["ids"],
+                    )
+                    if routing:
+                        self.label_index.add(stored["ids"], [metadata.get("label") for metadata in metadatas], stored["embeddings"])
+                    self.vectorstore = vectorstore
+        return self.vectorstore
+
+    def existing_chunk_ids(self, ids):
+        return self.open_vectorstore().get(ids=ids, include=[])["ids"]
+
+    def add_chunks(self, texts, ids):
+        vectorstore = self.open_vectorstore()
+        # Embed before taking the lock: the store's own embedding call inside it is then served by the embedding cache.
+        vectors = self.embeddings.embed_documents([text.page_content for text in texts])
+        with self.lock.exclusive():
+            vectorstore.add_documents(texts, ids=ids)
+            self.lexical_index.add(texts, ids)
+            if self.label_routing_min_chunks:
+                self.label_index.add(ids, [text.metadata.get("label") for text in texts], vectors)
+
+    def delete_chunks(self, ids):
+        vectorstore = self.open_vectorstore()
+        with self.lock.exclusive():
+            if self.label_routing_min_chunks:
+                # Centroids are sums, so the label index needs the vectors it is removing.
+                stored = vectorstore.get(ids=ids, include=["embeddings"])
+                self.label_index.remove(stored["ids"], stored["embeddings"])
+            vectorstore.delete(ids=ids)
+            self.lexical_index.remove(ids)
+
+    def memory_bytes(self):
+        """Estimated resident size: the in-memory indexes plus the vector store's."""
+        if self.vectorstore is None:
+            vectors = 0
+        elif hasattr(self.vectorstore, "memory_bytes"):
+            vectors = self.vectorstore.memory_bytes()
+        else:
+            # Chroma keeps the whole HNSW index of a loaded collection in memory.
+            vectors = len(self.lexical_index) * EMBEDDING_DIMENSIONS * 4
+        return self.lexical_index.memory_bytes() + self.label_index.memory_bytes() + vectors
+
+    def close(self):
+        if self.vectorstore is not None:
+            _close_store(self.vectorstore)
+            self.vectorstore = None
+
+    def update_document_set(self, new_directory, progress=None):
+        # Only changed files are parsed and written. One writer per tenant at a time; searches carry on between its
+        # batches, each applied under the exclusive lock, and a changed file's new chunks land before its old ones go.
+        with self.lock.writing():
+            self._ingest([new_directory], progress)
+
+    def rebuild(self, directories, progress=None):
+        """Build a new index version from directories and swap it in once it is complete.
+
+        Searches keep using the current version throughout, and it is deleted
+        once the last of them has finished. Unchanged chunks come from the
+        embedding and label caches, but every file is parsed and every chunk
+        written again, so this is for cold starts and full rebuilds only.
+        """
+        with self.lock.writing():
+            self.index_versions.collect()
+            shadow = copy.copy(self)
+            shadow._reset_index(self.index_versions.create())
+            # Nothing searches the shadow, so its batches need not wait for the live tenant's readers.
+            shadow.lock = TenantLock()
+            shadow._open_lock = threading.Lock()
+            try:
+                shadow._ingest(directories, progress)
+                shadow.open_vectorstore()
+            except BaseException:
+                shadow.close()
+                self.index_versions.discard(shadow.chroma_persist_dir)
+                raise
+            old_dir, old_store = self.chroma_persist_dir, self.vectorstore
+            with self.lock.exclusive():
+                self.vectorstore = shadow.vectorstore
+                self.lexical_index = shadow.lexical_index
+                self.label_index = shadow.label_index
+                self.manifest = shadow.manifest
+                self.chroma_persist_dir = shadow.chroma_persist_dir
+                self.dataset_version = next(_dataset_versions)
+            self.index_versions.activate(self.chroma_persist_dir)
+            self.index_versions.retire(old_dir, close=functools.partial(_close_store, old_store) if old_store is not None else None)
+        print(f"Swapped in index {os.path.basename(self.chroma_persist_dir)} for customer {self.customer_id}.")
+
+    def _ingest(self, directories, progress=None):
+        progress = progress or IngestionProgress()
+        file_paths = [file_path for directory in directories for file_path in supported_files(directory)]
+        changed_files = dict(self.manifest.changed_files(file_paths))
+        removed_files = [file_path for directory in directories for file_path in self.manifest.removed_files(directory, file_paths)]
+
+        stats = run_sync(IngestionPipeline(self, progress).run(changed_files, removed_files))
+        self.dataset_version = next(_dataset_versions)
+        print(f"Added {stats['new']} new and removed {stats['stale']} stale document chunks "
+              f"({len(changed_files)} changed, {len(removed_files)} removed, {stats['failed_files']} unparseable files) "
+              f"for customer {self.customer_id}.")
+
+def _close_store(vectorstore):
+    # For Chroma this releases the shared system for the directory once no other client uses it.
+    close = getattr(getattr(vectorstore, "_client", vectorstore), "close", None)
+    if close is not None:
+        close()
+
 
 class RAGChatbotManager:
-    def __init__(self):
-        self.customer_rags = {}
+    """Keeps at most max_tenants CustomerRAG instances loaded, evicting the least recently used.
+
+    Tenants idle for longer than idle_seconds, or beyond max_memory_bytes of
+    estimated index memory, are evicted too. A tenant with a request, an
+    ingestion or a cold-start build in flight is never evicted; an evicted
+    tenant is reloaded from disk on its next request.
+    """
+
+    def __init__(self, max_tenants=100, idle_seconds=1800, max_memory_bytes=None, clock=time.monotonic):
+        self.max_tenants = max_tenants
+        self.idle_seconds = idle_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.clock = clock
+        self.customer_rags = OrderedDict()
+        self.evictions = 0
+        self._last_used = {}
+        self._busy = {}
+        self._lock = threading.RLock()
 
     def get_customer_rag(self, customer_id):
-        if customer_id not in self.customer_rags:
-            self.customer_rags[customer_id] = CustomerRAG(customer_id)
-        return self.customer_rags[customer_id]
-
-    def update_customer_dataset(self, customer_id, new_directory):
-        customer_rag = self.get_customer_rag(customer_id)
-        customer_rag.update_document_set(new_directory)
-
-
-rag_manager = RAGChatbotManager()
+        return self._get(customer_id)
+
+    @contextmanager
+    def using(self, customer_id):
+        """The tenant's CustomerRAG, pinned in memory for the duration of the block."""
+        customer_rag = self._get(customer_id, pin=True)
+        try:
+            yield customer_rag
+        finally:
+            self._release(customer_id)
+
+    @asynccontextmanager
+    async def ausing(self, customer_id):
+        """``using`` for the event loop: loading the tenant, and closing the ones it evicts, run on a worker thread."""
+        task = asyncio.ensure_future(asyncio.to_thread(self._get, customer_id, True))
+        try:
+            customer_rag = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The thread still pins the tenant when it finishes; unpin it then.
+            task.add_done_callback(lambda done: done.cancelled() or done.exception() or self._release(customer_id))
+            raise
+        try:
+            yield customer_rag
+        finally:
+            self._release(customer_id)
+
+    def _get(self, customer_id, pin=False):
+        # Building and closing tenants happen outside the manager lock, so one tenant's load or eviction never stalls another's request.
+        built = None
+        while True:
+            with self._lock:
+                customer_rag = self.customer_rags.get(customer_id)
+                if customer_rag is None and built is not None:
+                    customer_rag = self.customer_rags[customer_id] = built
+                    built = None
+                if customer_rag is not None:
+                    self.customer_rags.move_to_end(customer_id)
+                    self._last_used[customer_id] = self.clock()
+                    if pin:
+                        self._busy[customer_id] = self._busy.get(customer_id, 0) + 1
+                    evicted = self._evict(keep=customer_id)
+                    break
+            built = CustomerRAG(customer_id)
+        if built is not None:
+            # Another request loaded the tenant first.
+            built.close()
+        self._close(evicted)
+        return customer_rag
+
+    def _release(self, customer_id):
+        with self._lock:
+            self._busy[customer_id] -= 1
+            if not self._busy[customer_id]:
+                del self._busy[customer_id]
+            self._last_used[customer_id] = self.clock()
+
+    def _evict(self, keep=None):
+        """Remove the tenants due for eviction and return them; the caller closes them once the lock is released."""
+        now = self.clock()
+        memory = None
+        evicted = []
+        for customer_id in list(self.customer_rags):
+            if customer_id == keep or customer_id in self._busy or self.customer_rags[customer_id].building():
+                continue
+            over_capacity = len(self.customer_rags) > self.max_tenants
+            idle = now - self._last_used.get(customer_id, now) > self.idle_seconds
+            over_memory = False
+            if self.max_memory_bytes and not (over_capacity or idle):
+                memory = memory if memory is not None else self.memory_bytes()
+                over_memory = memory > self.max_memory_bytes
+            if not (over_capacity or idle or over_memory):
+                # Entries are in LRU order, so the rest are more recent still.
+                break
+            if over_memory:
+                memory -= self.customer_rags[customer_id].memory_bytes()
+            evicted.append((customer_id, self.customer_rags.pop(customer_id)))
+            self._last_used.pop(customer_id, None)
+        return evicted
+
+    def evict(self, customer_id):
+        with self._lock:
+            if customer_id in self._busy or customer_id not in self.customer_rags or self.customer_rags[customer_id].building():
+                return False
+            customer_rag = self.customer_rags.pop(customer_id)
+            self._last_used.pop(customer_id, None)
+        self._close([(customer_id, customer_rag)])
+        return True
+
+    def _close(self, evicted):
+        for customer_id, customer_rag in evicted:
+            customer_rag.close()
+            rag_chains.invalidate(customer_id)
+            answer_caches.drop(customer_id)
+            self.evictions += 1
+            print(f"Evicted customer {customer_id} from memory.")
+
+    def memory_bytes(self):
+        with self._lock:
+            return sum(customer_rag.memory_bytes() for customer_rag in self.customer_rags.values())
+
+    def stats(self):
+        with self._lock:
+            tenants = {
+                customer_id: {
+                    "memory_bytes": customer_rag.memory_bytes(),
+                    "idle_seconds": round(self.clock() - self._last_used.get(customer_id, self.clock()), 1),
+                    "busy": self._busy.get(customer_id, 0),
+                }
+                for customer_id, customer_rag in self.customer_rags.items()
+            }
+        return {
+            "loaded": len(tenants),
+            "max_tenants": self.max_tenants,
+            "memory_bytes": sum(tenant["memory_bytes"] for tenant in tenants.values()),
+            "evictions": self.evictions,
+            "tenants": tenants,
+        }
 
-def format_docs(docs):
-    return "\n\n".join(doc.page_content for doc in docs)
+    def warm_up(self, customer_ids):
+        """Open the given tenants' collections ahead of their first request; meant to run in the background."""
+        for customer_id in customer_ids:
+            started = time.perf_counter()
+            try:
+                with self.using(customer_id) as customer_rag:
+                    customer_rag.load_index()
+            except Exception as e:
+                print(f"Failed to warm up customer {customer_id}: {e}")
+                continue
+            print(f"Warmed up customer {customer_id} in {time.perf_counter() - started:.1f} s.")
+
+    def update_customer_dataset(self, customer_id, new_directory, progress=None):
+        with self.using(customer_id) as customer_rag:
+            customer_rag.update_document_set(new_directory, progress)
+        answer_caches.invalidate(customer_id)
+
+
+rag_manager = RAGChatbotManager(
+    max_tenants=int(os.getenv("MAX_LOADED_TENANTS", 100)),
+    idle_seconds=float(os.getenv("TENANT_IDLE_SECONDS", 1800)),
+    max_memory_bytes=int(float(os.getenv("MAX_TENANT_MEMORY_MB", 2048)) * 1024 * 1024),
+)
 
-model = ChatGoogleGenerativeAI(model="gemini-1.5-flash", api_key=os.environ["GOOGLE_API_KEY2"], temperature=0.2)
+context_packer = ContextPacker(max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", 1500)))
 
 template = """
 You are a helpful and informative chatbot that answers questions using text from the reference passage included below. 
@@ -220,24 +523,130 @@ ANSWER:
 """
 QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
 
-def generate_response(query, history, customer_id):
-    retriever = get_retriever(customer_id)
+summary_template = """
+Update the running summary of a conversation between a user and a chatbot with the new turns below.
+Keep the facts, names, numbers and open questions the user cares about and drop small talk. Use at most {max_words} words.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW TURNS:
+{turns}
+
+UPDATED SUMMARY:
 
-    def _combine_documents(docs):
-        return format_docs(docs)
-    
-    rag_chain = (
+"""
+SUMMARY_PROMPT = PromptTemplate.from_template(summary_template)
+
+rag_chains = ChainCache()
+
+def build_rag_chain(customer_rag):
+    customer_rag.load_index()
+    answer_chain = (
         {
-            "context": lambda x: _combine_documents(retriever.invoke(x["query"])),
-            "query": RunnablePassthrough(),
-            "history": RunnablePassthrough(),
+            "context": itemgetter("docs") | RunnableLambda(context_packer.pack),
+            "query": itemgetter("query"),
+            "history": itemgetter("history"),
         }
         | QA_CHAIN_PROMPT
-        | model
+        | get_model()
         | StrOutputParser()
     )
-    result = rag_chain.invoke(input={"query": query, "history": history})
-    return result
+    # The retrieved documents stay in the output so streaming callers can report their sources.
+    return (
+        RunnablePassthrough.assign(docs=itemgetter("query") | customer_rag.get_retriever())
+        | RunnablePassthrough.assign(answer=answer_chain)
+    )
+
+def _rag_chain(customer_rag):
+    return rag_chains.get(customer_rag.customer_id, customer_rag.dataset_version, lambda: build_rag_chain(customer_rag))
+
+async def _arag_chain(customer_rag):
+    rag_chain = rag_chains.cached(customer_rag.customer_id, customer_rag.dataset_version)
+    if rag_chain is None:
+        # Building can cold-load the tenant's index, which is blocking work.
+        rag_chain = await asyncio.to_thread(_rag_chain, customer_rag)
+    return rag_chain
+
+def get_rag_chain(customer_id):
+    return _rag_chain(rag_manager.get_customer_rag(customer_id))
+
+async def aget_rag_chain(customer_id):
+    return await _arag_chain(await asyncio.to_thread(rag_manager.get_customer_rag, customer_id))
+
+def _unique(values):
+    return list(dict.fromkeys(value for value in values if value is not None))
+
+def _answer_metadata(docs):
+    return {
+        "sources": _unique(doc.metadata.get("source") for doc in docs),
+        "labels": _unique(doc.metadata.get("label") for doc in docs),
+    }
+
+def generate_response(query, history, customer_id):
+    with rag_manager.using(customer_id) as customer_rag:
+        version = customer_rag.dataset_version
+        answer_cache = answer_caches.get(customer_id)
+        rag_chain = _rag_chain(customer_rag)
+        # The query embedding is cached, so retrieval reuses it on a miss.
+        embedding = customer_rag.query_embedding(query)
+        cached = answer_cache.lookup(query, embedding, history, version)
+        if cached is not None:
+            return cached["answer"]
+
+        result = rag_chain.invoke(input={"query": query, "history": history})
+        answer_cache.put(query, embedding, history, version, result["answer"], _answer_metadata(result["docs"]))
+        return result["answer"]
+
+async def agenerate_response(query, history, customer_id):
+    async with rag_manager.ausing(customer_id) as customer_rag:
+        version = customer_rag.dataset_version
+        answer_cache = answer_caches.get(customer_id)
+        rag_chain = await _arag_chain(customer_rag)
+        embedding = await customer_rag.aquery_embedding(query)
+        cached = answer_cache.lookup(query, embedding, history, version)
+        if cached is not None:
+            return cached["answer"]
+
+        result = await rag_chain.ainvoke(input={"query": query, "history": history})
+        answer_cache.put(query, embedding, history, version, result["answer"], _answer_metadata(result["docs"]))
+        return result["answer"]
+
+async def astream_response(query, history, customer_id):
+    """Yield ("token", text) pairs as the answer is generated, then one ("metadata", dict) pair."""
+    started = time.perf_counter()
+
+    def elapsed_ms():
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    async with rag_manager.ausing(customer_id) as customer_rag:
+        version = customer_rag.dataset_version
+        answer_cache = answer_caches.get(customer_id)
+        rag_chain = await _arag_chain(customer_rag)
+        embedding = await customer_rag.aquery_embedding(query)
+        cached = answer_cache.lookup(query, embedding, history, version)
+        if cached is not None:
+            yield "token", cached["answer"]
+            yield "metadata", {**cached["metadata"], "cached": True, "timings": {"total_ms": elapsed_ms()}}
+            return
+
+        docs, tokens, timings = [], [], {}
+        async for chunk in rag_chain.astream({"query": query, "history": history}):
+            if "docs" in chunk:
+                docs = chunk["docs"]
+                timings.setdefault("retrieval_ms", elapsed_ms())
+            if chunk.get("answer"):
+                timings.setdefault("first_token_ms", elapsed_ms())
+                tokens.append(chunk["answer"])
+                yield "token", chunk["answer"]
+        timings["total_ms"] = elapsed_ms()
+        metadata = _answer_metadata(docs)
+        answer_cache.put(query, embedding, history, version, "".join(tokens), metadata)
+        yield "metadata", {**metadata, "cached": False, "timings": timings}
+
+async def asummarize_history(summary, turns, max_words):
+    chain = SUMMARY_PROMPT | get_model() | StrOutputParser()
+    return await chain.ainvoke({"summary": summary or "(none)", "turns": turns, "max_words": max_words})
 
 def get_retriever(customer_id):
     customer_rag = rag_manager.get_customer_rag(customer_id)
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from chunker import StructuredChunker, estimate_tokens
+
+
+def format_turns(turns):
+    return "\n".join(f"Human: {human}\nAI: {ai}" for human, ai in turns)
+
+
+def _truncate(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return StructuredChunker(max_tokens, 0).split_text(text)[0][1]
+
+
+class ChatSession:
+    def __init__(self, session_id, customer_id):
+        self.id = session_id
+        self.customer_id = customer_id
+        self.turns = []
+        self.summary = ""
+        # Turns that have left the window but are not folded into the summary yet.
+        self.pending = []
+        self.last_used = time.monotonic()
+        self.compacting = asyncio.Lock()
+
+
+class SessionStore:
+    """Server-side chat history: the last window_turns turns verbatim plus a running summary of the rest.
+
+    The history handed to the prompt never exceeds max_history_tokens,
+    whatever the length of the conversation. Evicted turns are folded into
+    the summary by ``summarize(summary, turns_text, max_words)`` in
+    ``compact``, which callers run after the answer has been sent; until
+    then they stay in the history, and at most max_pending_turns of them
+    are kept if summarizing keeps failing.
+    """
+
+    def __init__(self, summarize, window_turns=6, max_history_tokens=1200, summary_tokens=300,
+                 ttl_seconds=3600, max_sessions=10000, max_pending_turns=None):
+        self.summarize = summarize
+        self.window_turns = window_turns
+        self.max_pending_turns = max_pending_turns if max_pending_turns is not None else window_turns * 4
+        self.max_history_tokens = max_history_tokens
+        self.summary_tokens = summary_tokens
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, customer_id, session_id=None):
+        """The session for (customer_id, session_id), created on first use; a new id is generated when none is given."""
+        session_id = session_id or uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            key = (customer_id, session_id)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = ChatSession(session_id, customer_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(key)
+            session.last_used = now
+            return session
+
+    def delete(self, customer_id, session_id):
+        with self._lock:
+            return self._sessions.pop((customer_id, session_id), None) is not None
+
+    def _expire(self, now):
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.ttl_seconds:
+                break
+            del self._sessions[key]
+
+    def history(self, session):
+        return self.bounded_history(session.turns, session.summary, session.pending)
+
+    def bounded_history(self, turns, summary="", pending=()):
+        """Format a summary and the most recent turns so the result stays within max_history_tokens.
+
+        pending turns are older than turns and not in the summary yet; they are kept as far as the budget allows.
+        """
+        parts = []
+        budget = self.max_history_tokens
+        if summary:
+            summary_text = f"Summary of the earlier conversation: {_truncate(summary, self.summary_tokens)}"
+            parts.append(summary_text)
+            budget -= estimate_tokens(summary_text)
+        recent = []
+        for human, ai in reversed(list(pending) + turns[-self.window_turns:]):
+            text = format_turns([(human, ai)])
+            tokens = estimate_tokens(text)
+            if tokens > budget:
+                if not recent and budget > 0:
+                    # Always keep some of the latest turn, cut down to what fits.
+                    recent.append(_truncate(text, budget))
+                break
+            recent.append(text)
+            budget -= tokens
+        return "\n".join(parts + list(reversed(recent)))
+
+    def record(self, session, human, ai):
+        session.turns.append((human, ai))
+        overflow = len(session.turns) - self.window_turns
+        if overflow > 0:
+            session.pending.extend(session.turns[:overflow])
+            del session.turns[:overflow]
+        dropped = len(session.pending) - self.max_pending_turns
+        if dropped > 0:
+            del session.pending[:dropped]
+            print(f"Dropped {dropped} unsummarized turns from session {session.id}.")
+
+    async def compact(self, session):
+        """Fold turns that left the window into the summary with one model call."""
+        async with session.compacting:
+            if not session.pending:
+                return
+            # The turns stay pending, and so in the history, until the summary that covers them lands.
+            turns = list(session.pending)
+            try:
+                summary = await self.summarize(session.summary, format_turns(turns), self.summary_tokens * 3 // 4)
+            except Exception as e:
+                # Keep the turns for the next attempt rather than losing them.
+                print(f"Failed to summarize session {session.id}: {e}")
+                return
+            session.summary = _truncate(summary.strip(), self.summary_tokens)
+            # By identity: turns may have been added, or the oldest dropped, while the model was answering.
+            summarized = {id(turn) for turn in turns}
+            session.pending = [turn for turn in session.pending if id(turn) not in summarized]
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions)}
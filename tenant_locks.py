@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """Many readers or one writer, alternating in phases.
+
+    A waiting writer holds back new readers, so a steady stream of chats
+    cannot starve it; releasing a write admits every reader that queued
+    behind it before the next writer, so a queue of writers cannot starve
+    chats either.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._waiting_readers = 0
+        self._phase = 0
+
+    def acquire_read(self, blocking=True):
+        with self._condition:
+            if not self._writer and not self._waiting_writers:
+                self._readers += 1
+                return True
+            if not blocking:
+                return False
+            self._waiting_readers += 1
+            phase = self._phase
+            while phase == self._phase:
+                self._condition.wait()
+            # Counted in by release_write.
+            return True
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._readers += self._waiting_readers
+            self._waiting_readers = 0
+            self._phase += 1
+            self._condition.notify_all()
+
+
+class TenantLock:
+    """Coordination for one tenant's index and dataset files.
+
+    ``read()`` is held by searches, any number at a time.
+    ``exclusive()`` is held by changes to the live index (an in-place batch,
+    or swapping in a rebuilt version): it waits for searches in progress and
+    holds back new ones, so it must only cover short steps. ``writing()``
+    serializes whole ingestions and rebuilds without blocking searches, and
+    ``files()`` serializes read-modify-write of the dataset files.
+    """
+
+    def __init__(self):
+        self._rw = ReadWriteLock()
+        self._writer = threading.RLock()
+        self._files = threading.Lock()
+
+    @contextmanager
+    def read(self):
+        self._rw.acquire_read()
+        try:
+            yield
+        finally:
+            self._rw.release_read()
+
+    @contextmanager
+    def exclusive(self):
+        self._rw.acquire_write()
+        try:
+            yield
+        finally:
+            self._rw.release_write()
+
+    @contextmanager
+    def writing(self):
+        with self._writer:
+            yield
+
+    @contextmanager
+    def files(self):
+        with self._files:
+            yield
+
+
+class TenantLocks:
+    def __init__(self):
+        # A tenant's lock lives as long as something holds it, so idle tenants cost nothing.
+        self._locks = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, customer_id):
+        with self._lock:
+            lock = self._locks.get(customer_id)
+            if lock is None:
+                lock = self._locks[customer_id] = TenantLock()
+            return lock
+
+
+@contextmanager
+def atomic_writer(path, mode="w", encoding="utf-8"):
+    """A file that replaces path in one rename when the block exits, so readers see the old or the new file, never a partial one."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write(path, text, encoding="utf-8"):
+    with atomic_writer(path, "w", encoding) as f:
+        f.write(text)
+
+
+tenant_locks = TenantLocks()
@@ -0,0 +1,124 @@
+import os
+
+import numpy as np
+import pytest
+
+from vector_store import QUANTIZATIONS, ArrayVectorStore
+
+DIMENSIONS = 16
+
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, DIMENSIONS)).astype(np.float32)
+
+
+def add(store, count, prefix="chunk", seed=0):
+    ids = [f"{prefix}-{i}" for i in range(count)]
+    store.add_vectors(vectors(count, seed), [f"text {i}" for i in range(count)], [{"label": f"topic {i % 3}"} for i in range(count)], ids)
+    return ids
+
+
+def exact_ids(store, query, k):
+    stored = store.get(include=["embeddings"])
+    unit = stored["embeddings"] / np.linalg.norm(stored["embeddings"], axis=1, keepdims=True)
+    return [stored["ids"][i] for i in np.argsort(-(unit @ query))[:k]]
+
+
+@pytest.mark.parametrize("quantization", (None,) + QUANTIZATIONS)
+@pytest.mark.parametrize("kwargs", [{}, {"ids": ["chunk-0"]}, {"filter": {"label": "topic 0"}}])
+def test_search_on_empty_store(tmp_path, quantization, kwargs):
+    store = ArrayVectorStore(str(tmp_path), None, quantization=quantization)
+    assert store.similarity_search_by_vector(vectors(1)[0], 5, **kwargs) == []
+
+    ids = add(store, 10)
+    store.delete(ids)
+    assert store.similarity_search_by_vector(vectors(1)[0], 5, **kwargs) == []
+
+
+def test_torn_write_recovery(tmp_path):
+    store = ArrayVectorStore(str(tmp_path), None)
+    ids = add(store, 10)
+    store.close()
+    # A crash in the middle of the next batch: half a vector and half a record reach the disk.
+    with open(tmp_path / "vectors.0.f32", "ab") as f:
+        f.write(vectors(1, seed=1).tobytes()[:DIMENSIONS * 2])
+    with open(tmp_path / "records.0.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"id": "chunk-10", "te')
+
+    store = ArrayVectorStore(str(tmp_path), None)
+    assert store.get(include=[])["ids"] == ids
+    query = vectors(1, seed=2)[0]
+    assert [document.id for document in store.similarity_search_by_vector(query, 3)] == exact_ids(store, query, 3)
+
+    # Writes after recovery land in a clean generation and survive another reopen.
+    more = add(store, 5, prefix="more", seed=3)
+    store.close()
+    store = ArrayVectorStore(str(tmp_path), None)
+    assert store.get(include=[])["ids"] == ids + more
+    assert not os.path.exists(tmp_path / "vectors.0.f32")
+
+
+def test_records_without_vectors_are_dropped(tmp_path):
+    store = ArrayVectorStore(str(tmp_path), None)
+    ids = add(store, 10)
+    store.close()
+    with open(tmp_path / "vectors.0.f32", "r+b") as f:
+        f.truncate(8 * DIMENSIONS * 4)
+
+    store = ArrayVectorStore(str(tmp_path), None)
+    assert store.get(include=[])["ids"] == ids[:8]
+
+
+def test_hnsw_search(tmp_path):
+    pytest.importorskip("hnswlib")
+    store = ArrayVectorStore(str(tmp_path), None, hnsw_threshold=50)
+    ids = add(store, 200)
+    store.delete(ids[:20])
+    queries = vectors(20, seed=4)
+    for query in queries:
+        found = [document.id for document in store.similarity_search_by_vector(query, 5)]
+        assert store._hnsw is not None
+        assert not set(found) & set(ids[:20])
+        assert len(set(found) & set(exact_ids(store, query, 5))) >= 4
+
+    # The saved graph is reused on reopen, with deletes made after it was saved applied.
+    store.delete(ids[20:40])
+    store.close()
+    store = ArrayVectorStore(str(tmp_path), None, hnsw_threshold=50)
+    for query in queries:
+        found = [document.id for document in store.similarity_search_by_vector(query, 5)]
+        assert not set(found) & set(ids[:40])
+
+    # Vectors added after the graph was built are searchable, also after further deletes.
+    more = add(store, 100, prefix="more", seed=5)
+    new_vectors = vectors(100, seed=5)
+    assert store.similarity_search_by_vector(new_vectors[7], 1)[0].id == more[7]
+    store.delete(ids[40:])
+    assert store.count() == 100
+    assert store.similarity_search_by_vector(new_vectors[42], 1)[0].id == more[42]
+
+
+def test_repeated_id_in_one_batch(tmp_path):
+    store = ArrayVectorStore(str(tmp_path), None)
+    batch = vectors(2)
+    store.add_vectors(batch, ["first", "second"], [{}, {}], ["x", "x"])
+    assert store.count() == 1
+    assert [document.page_content for document in store.similarity_search_by_vector(batch[0], 5)] == ["second"]
+    store.close()
+    store = ArrayVectorStore(str(tmp_path), None)
+    assert store.get(ids=["x"])["documents"] == ["second"]
+
+
+def test_lost_replacement_falls_back_to_previous_row(tmp_path):
+    store = ArrayVectorStore(str(tmp_path), None)
+    first, second = vectors(2)
+    store.add_vectors(first[None], ["first"], [{}], ["y"])
+    store.add_vectors(second[None], ["second"], [{}], ["y"])
+    store.close()
+    # The replacing record reached the disk, its vector did not.
+    with open(tmp_path / "vectors.0.f32", "r+b") as f:
+        f.truncate(DIMENSIONS * 4)
+
+    store = ArrayVectorStore(str(tmp_path), None)
+    assert store.get()["documents"] == ["first"]
+    assert [document.page_content for document in store.similarity_search_by_vector(first, 5)] == ["first"]
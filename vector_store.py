@@ -0,0 +1,530 @@
+import json
+import os
+import threading
+import uuid
+from typing import List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+HNSW_THRESHOLD = int(os.getenv("VECTOR_HNSW_THRESHOLD", 20000))
+# float16 is not offered: NumPy has no BLAS path for it, so a scan over float16 codes is an order of magnitude
+# slower than over float32 for half the memory int8 saves.
+QUANTIZATIONS = ("int8",)
+# Quantization for every customer's array store, and per-customer overrides such as "3=int8,7=none".
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+VECTOR_QUANTIZATION_CUSTOMERS = dict(
+    entry.strip().split("=", 1) for entry in os.getenv("VECTOR_QUANTIZATION_CUSTOMERS", "").split(",") if entry.strip()
+)
+
+
+def quantization_for(customer_id):
+    quantization = VECTOR_QUANTIZATION_CUSTOMERS.get(str(customer_id), VECTOR_QUANTIZATION).strip().lower()
+    if quantization in ("", "none"):
+        return None
+    if quantization not in QUANTIZATIONS:
+        print(f"Unknown vector quantization {quantization!r} for customer {customer_id}; using none.")
+        return None
+    return quantization
+
+_OPERATORS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+}
+
+
+def matches(metadata, where):
+    """Whether metadata satisfies a Chroma-style where filter."""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, clause) for clause in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator not in _OPERATORS:
+                    raise ValueError(f"Unsupported filter operator {operator}")
+                if not _OPERATORS[operator](value, operand):
+                    return False
+    return True
+
+
+def quantize(vectors, quantization):
+    """Quantized codes for float32 rows, with the factor that turns a code's dot product into a cosine similarity.
+
+    int8 codes use one symmetric scale per row, so the factor is that scale
+    over the row's norm.
+    """
+    inverse_norms = _inverse(np.linalg.norm(vectors, axis=1))
+    if quantization == "int8":
+        scales = np.abs(vectors).max(axis=1, initial=0) / 127
+        codes = np.round(vectors * _inverse(scales)[:, None]).astype(np.int8)
+        return codes, scales * inverse_norms
+    raise ValueError(f"Unknown quantization {quantization!r}")
+
+
+def _inverse(values):
+    return np.divide(1.0, values, out=np.zeros_like(values, dtype=np.float32), where=values > 0).astype(np.float32)
+
+
+def _scores(matrix, factors, query, rows=None, alive=None):
+    # Quantized codes are widened block by block, so a scan never holds a float32 copy of the whole matrix.
+    if rows is not None:
+        return (np.asarray(matrix[rows], dtype=np.float32) @ query) * factors[rows]
+    if matrix.dtype == np.float32:
+        scores = np.asarray(matrix @ query)
+    else:
+        scores = np.empty(len(factors), dtype=np.float32)
+        # Small blocks keep the widened copy in cache: 4096-row blocks made the int8 scan almost twice as slow.
+        for start in range(0, len(scores), 256):
+            scores[start:start + 256] = np.asarray(matrix[start:start + 256], dtype=np.float32) @ query
+    scores *= factors
+    scores[~alive] = -np.inf
+    return scores
+
+
+def _top(scores, k):
+    k = min(k, len(scores))
+    if not k:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return top[np.isfinite(scores[top])]
+
+
+class _State:
+    # Replaced as a whole on every write, so searches never see a half-applied change.
+    __slots__ = ("vectors", "inverse_norms", "alive", "ids", "texts", "metadatas", "codes", "factors")
+
+    def __init__(self, vectors, inverse_norms, alive, ids, texts, metadatas, codes=None, factors=None):
+        self.vectors = vectors
+        self.inverse_norms = inverse_norms
+        self.alive = alive
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.codes = codes
+        self.factors = factors
+
+
+class ArrayVectorStore(VectorStore):
+    """One customer's chunks in flat files: a memory-mapped float32 matrix plus a JSON-lines record log.
+
+    Search is an exact NumPy scan of the matrix (cosine similarity), which is
+    faster than Chroma's HNSW index for the few hundred to few thousand chunks
+    most tenants have, and costs nothing to open. Above ``hnsw_threshold``
+    live chunks an hnswlib graph is built on first search, when hnswlib is
+    installed. Searches restricted by ``ids`` or ``filter`` always scan their
+    candidates exactly.
+
+    With ``quantization`` set to "int8", the scan runs over
+    quantized codes kept in memory and only the best ``rerank_factor * k``
+    candidates are re-scored against the float32 vectors on disk, which are
+    then rarely paged in. The codes are derived from those vectors when the
+    store is opened, so the mode can be changed between opens. Quantized
+    stores never build the HNSW graph, which would hold a float32 copy.
+
+    Adds and deletes are appended to the files; rows are rewritten into a
+    new generation once more than half of them are deleted. ``get``,
+    ``delete`` and ``similarity_search_by_vector(..., filter=, ids=)`` follow
+    the Chroma wrapper, so CustomerRAG can use either backend.
+    """
+
+    def __init__(self, persist_directory, embedding_function, hnsw_threshold=HNSW_THRESHOLD, hnsw_ef=64, hnsw_m=16,
+                 quantization=None, rerank_factor=4):
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}")
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        self.hnsw_threshold = hnsw_threshold
+        self.hnsw_ef = hnsw_ef
+        self.hnsw_m = hnsw_m
+        self._lock = threading.RLock()
+        self._hnsw = None
+        self._row_of = {}
+        self._generation = 0
+        self._dimensions = 0
+        os.makedirs(persist_directory, exist_ok=True)
+        self._open()
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def _path(self, name, generation=None):
+        generation = self._generation if generation is None else generation
+        return os.path.join(self.persist_directory, name.format(generation=generation))
+
+    def _open(self):
+        index_path = os.path.join(self.persist_directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self._generation = index["generation"]
+            self._dimensions = index["dimensions"]
+
+        records, torn = [], False
+        records_path = self._path("records.{generation}.jsonl")
+        if os.path.exists(records_path):
+            with open(records_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        torn = True  # A write cut short by a crash; everything before it is intact.
+                        break
+
+        # Records whose vectors never reached the disk are dropped before any of them replaces an older row.
+        vectors = self._map(sum(1 for record in records if "delete" not in record))
+        vectors_path = self._path("vectors.{generation}.f32")
+        stored_bytes = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+        ids, texts, metadatas, alive = [], [], [], []
+        for record in records:
+            if "delete" in record:
+                for chunk_id in record["delete"]:
+                    row = self._row_of.pop(chunk_id, None)
+                    if row is not None:
+                        alive[row] = False
+                continue
+            if len(ids) == len(vectors):
+                torn = True
+                break
+            row = self._row_of.get(record["id"])
+            if row is not None:
+                alive[row] = False
+            self._row_of[record["id"]] = len(ids)
+            ids.append(record["id"])
+            texts.append(record["text"])
+            metadatas.append(record["metadata"])
+            alive.append(True)
+        inverse_norms, codes, factors = self._encode(vectors)
+        self._state = _State(vectors, inverse_norms, np.array(alive, dtype=bool), ids, texts, metadatas, codes, factors)
+        if torn or stored_bytes != len(ids) * self._dimensions * 4:
+            # Appends after a partial write would be misaligned, so start a clean generation.
+            self._compact()
+
+    def _encode(self, vectors):
+        """Inverse row norms, plus quantized codes and their factors when the store is quantized."""
+        inverse_norms, codes, factors = [], [], []
+        for start in range(0, max(len(vectors), 1), 4096):
+            block = np.asarray(vectors[start:start + 4096], dtype=np.float32)
+            inverse_norms.append(_inverse(np.linalg.norm(block, axis=1)))
+            if self.quantization:
+                block_codes, block_factors = quantize(block, self.quantization)
+                codes.append(block_codes)
+                factors.append(block_factors)
+        if not self.quantization:
+            return np.concatenate(inverse_norms), None, None
+        return np.concatenate(inverse_norms), np.concatenate(codes), np.concatenate(factors)
+
+    def _map(self, rows):
+        path = self._path("vectors.{generation}.f32")
+        if not self._dimensions or not os.path.exists(path):
+            return np.empty((0, self._dimensions), dtype=np.float32)
+        rows = min(rows, os.path.getsize(path) // (self._dimensions * 4))
+        if not rows:
+            return np.empty((0, self._dimensions), dtype=np.float32)
+        return np.memmap(path, dtype=np.float32, mode="r", shape=(rows, self._dimensions))
+
+    def _write_index(self):
+        index_path = os.path.join(self.persist_directory, "index.json")
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dimensions": self._dimensions, "generation": self._generation}, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def count(self):
+        return len(self._row_of)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids is not None else [uuid.uuid4().hex for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        vectors = np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32)
+        self.add_vectors(vectors, texts, metadatas, ids)
+        return ids
+
+    def add_documents(self, documents, **kwargs) -> List[str]:
+        return self.add_texts(
+            [document.page_content for document in documents],
+            [document.metadata for document in documents],
+            ids=kwargs.get("ids"),
+        )
+
+    def add_vectors(self, vectors, texts, metadatas, ids):
+        """Store precomputed vectors; existing ids are replaced, as in Chroma's upsert."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        ids = list(ids)
+        if len(set(ids)) < len(ids):
+            # A repeated id keeps its last occurrence, as applying the batch one by one would.
+            keep = sorted({chunk_id: i for i, chunk_id in enumerate(ids)}.values())
+            vectors, texts, metadatas = vectors[keep], [texts[i] for i in keep], [metadatas[i] for i in keep]
+            ids = [ids[i] for i in keep]
+        with self._lock:
+            if not self._dimensions:
+                self._dimensions = vectors.shape[1]
+                self._write_index()
+            elif vectors.shape[1] != self._dimensions:
+                raise ValueError(f"Expected {self._dimensions}-dimensional vectors, got {vectors.shape[1]}")
+            state = self._state
+            first_row = len(state.ids)
+            # Vectors first: on open, records without a vector are dropped, never the other way round.
+            with open(self._path("vectors.{generation}.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._path("records.{generation}.jsonl"), "a", encoding="utf-8") as f:
+                for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                    f.write(json.dumps({"id": chunk_id, "text": text, "metadata": metadata or {}}) + "\n")
+
+            alive = np.concatenate([state.alive, np.ones(len(ids), dtype=bool)])
+            replaced = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+            alive[replaced] = False
+            for offset, chunk_id in enumerate(ids):
+                self._row_of[chunk_id] = first_row + offset
+            inverse_norms, codes, factors = self._encode(vectors)
+            self._state = _State(
+                self._map(first_row + len(ids)),
+                np.concatenate([state.inverse_norms, inverse_norms]),
+                alive,
+                state.ids + list(ids),
+                state.texts + list(texts),
+                state.metadatas + [metadata or {} for metadata in metadatas],
+                # An empty store may not have known its dimensions when it was opened.
+                np.concatenate([state.codes, codes]) if codes is not None and first_row else codes,
+                np.concatenate([state.factors, factors]) if factors is not None and first_row else factors,
+            )
+            if self._hnsw is not None:
+                self._hnsw_mark_deleted(replaced)
+                self._hnsw_add(vectors, first_row)
+            self._maybe_compact()
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return
+        with self._lock:
+            rows = [self._row_of.pop(chunk_id) for chunk_id in ids if chunk_id in self._row_of]
+            if not rows:
+                return
+            with open(self._path("records.{generation}.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"delete": list(ids)}) + "\n")
+            state = self._state
+            alive = state.alive.copy()
+            alive[rows] = False
+            self._state = _State(state.vectors, state.inverse_norms, alive, state.ids, state.texts, state.metadatas, state.codes, state.factors)
+            if self._hnsw is not None:
+                self._hnsw_mark_deleted(rows)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        dead = len(self._state.ids) - len(self._row_of)
+        if dead > max(len(self._row_of), 256):
+            self._compact()
+
+    def _compact(self):
+        # Live rows go to a new generation; index.json switches to it in one rename.
+        state = self._state
+        rows = np.flatnonzero(state.alive)
+        old_generation, self._generation = self._generation, self._generation + 1
+        with open(self._path("vectors.{generation}.f32"), "wb") as f:
+            for start in range(0, len(rows), 4096):
+                f.write(np.ascontiguousarray(state.vectors[rows[start:start + 4096]]).tobytes())
+        with open(self._path("records.{generation}.jsonl"), "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({"id": state.ids[row], "text": state.texts[row], "metadata": state.metadatas[row]}) + "\n")
+        self._write_index()
+        for name in ("vectors.{generation}.f32", "records.{generation}.jsonl", "hnsw.{generation}.bin"):
+            path = self._path(name, old_generation)
+            if os.path.exists(path):
+                os.remove(path)
+
+        ids = [state.ids[row] for row in rows]
+        self._row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+        self._state = _State(
+            self._map(len(rows)),
+            state.inverse_norms[rows],
+            np.ones(len(rows), dtype=bool),
+            ids,
+            [state.texts[row] for row in rows],
+            [state.metadatas[row] for row in rows],
+            state.codes[rows] if state.codes is not None else None,
+            state.factors[rows] if state.factors is not None else None,
+        )
+        self._hnsw = None
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None, **kwargs):
+        include = ["documents", "metadatas"] if include is None else include
+        state = self._state
+        if ids is not None:
+            rows = [self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of]
+        else:
+            rows = np.flatnonzero(state.alive).tolist()
+        if where:
+            rows = [row for row in rows if matches(state.metadatas[row], where)]
+        rows = rows[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+        result = {"ids": [state.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [state.texts[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [state.metadatas[row] for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = np.array(state.vectors[rows]) if rows else np.empty((0, self._dimensions), dtype=np.float32)
+        return result
+
+    def get_by_ids(self, ids):
+        stored = self.get(ids=ids)
+        return [
+            Document(id=chunk_id, page_content=text, metadata=metadata)
+            for chunk_id, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+        ]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, filter=filter, **kwargs)
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, filter=filter, **kwargs)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, ids=None, **kwargs):
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k, filter=filter, ids=ids)]
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, ids=None, **kwargs):
+        """The k nearest chunks with their cosine distance (0 is identical, lower is closer)."""
+        query = np.asarray(embedding, dtype=np.float32)
+        state = self._state
+        if not state.alive.any():
+            # Nothing to score; an empty store does not even know its dimensions yet.
+            return []
+        if ids is not None or filter:
+            if ids is not None:
+                rows = np.fromiter((self._row_of[chunk_id] for chunk_id in ids if chunk_id in self._row_of), dtype=np.int64)
+            else:
+                rows = np.flatnonzero(state.alive)
+            if filter:
+                rows = rows[[matches(state.metadatas[row], filter) for row in rows]] if len(rows) else rows
+            found = self._exact(state, query, k, rows)
+        elif state.codes is None and len(self._row_of) >= self.hnsw_threshold and hnswlib is not None:
+            state, found = self._approximate(query, k)
+        else:
+            found = self._exact(state, query, k)
+        return [
+            (Document(id=state.ids[row], page_content=state.texts[row], metadata=state.metadatas[row]), distance)
+            for row, distance in found
+        ]
+
+    def _exact(self, state, query, k, rows=None):
+        if state.codes is not None:
+            # Shortlist on the quantized codes, then re-score the shortlist at full precision.
+            shortlist = _top(_scores(state.codes, state.factors, query, rows, state.alive), k * self.rerank_factor)
+            rows = shortlist if rows is None else rows[shortlist]
+        scores = _scores(state.vectors, state.inverse_norms, query, rows, state.alive)
+        query_norm = np.linalg.norm(query) or 1.0
+        return [
+            (int(rows[i]) if rows is not None else int(i), max(float(1 - scores[i] / query_norm), 0.0))
+            for i in _top(scores, k)
+        ]
+
+    def _approximate(self, query, k):
+        # Graph rows are only valid for the state they were added from, so both are read under the lock.
+        with self._lock:
+            if self._hnsw is None:
+                self._build_hnsw()
+            state = self._state
+            k = min(k, len(self._row_of))
+            if not k:
+                return state, []
+            self._hnsw.set_ef(max(self.hnsw_ef, k))
+            labels, distances = self._hnsw.knn_query(query, k=k)
+        return state, [(int(row), float(distance)) for row, distance in zip(labels[0], distances[0])]
+
+    def _build_hnsw(self):
+        state = self._state
+        self._hnsw = hnswlib.Index(space="cosine", dim=self._dimensions)
+        path = self._path("hnsw.{generation}.bin")
+        if os.path.exists(path):
+            self._hnsw.load_index(path, max_elements=len(state.ids))
+            if self._hnsw.get_current_count() == len(state.ids):
+                # Deletes made after the graph was saved are not in it yet.
+                self._hnsw_mark_deleted(np.flatnonzero(~state.alive).tolist())
+                return
+            self._hnsw = hnswlib.Index(space="cosine", dim=self._dimensions)
+        self._hnsw.init_index(max_elements=max(len(state.ids), 1), ef_construction=200, M=self.hnsw_m)
+        for start in range(0, len(state.ids), 4096):
+            self._hnsw_add(state.vectors[start:start + 4096], start)
+        self._hnsw_mark_deleted(np.flatnonzero(~state.alive).tolist())
+        self._hnsw.save_index(path)
+
+    def _hnsw_add(self, vectors, first_row):
+        needed = first_row + len(vectors)
+        if needed > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(max(needed, self._hnsw.get_max_elements() * 2))
+        self._hnsw.add_items(np.asarray(vectors), np.arange(first_row, needed))
+
+    def _hnsw_mark_deleted(self, rows):
+        for row in rows:
+            try:
+                self._hnsw.mark_deleted(row)
+            except RuntimeError:
+                pass  # Already deleted.
+
+    def memory_bytes(self):
+        state = self._state
+        if state.codes is not None:
+            # Only re-ranked rows of the memory-mapped float32 vectors are ever paged in.
+            vectors = state.codes.nbytes + state.factors.nbytes
+        elif self._hnsw is not None:
+            # The graph holds its own float32 copy; the mapped vectors are only read to rebuild it.
+            vectors = len(state.ids) * (self._dimensions * 4 + self.hnsw_m * 2 * 4)
+        else:
+            # Every exact scan reads the whole mapped matrix, so it stays in the page cache.
+            vectors = state.vectors.nbytes
+        return vectors + state.inverse_norms.nbytes + state.alive.nbytes + 200 * len(state.ids) + sum(map(len, state.texts))
+
+    def close(self):
+        with self._lock:
+            if self._hnsw is not None:
+                self._hnsw.save_index(self._path("hnsw.{generation}.bin"))
+                self._hnsw = None
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, persist_directory=None, **kwargs):
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+
+def open_vector_store(persist_directory, embedding_function, backend=VECTOR_STORE_BACKEND, quantization=None):
+    """The customer's vector store: ``chroma`` or ``array`` (ArrayVectorStore in an ``array_index`` subdirectory).
+
+    Quantization only applies to the array backend.
+    """
+    if backend == "array":
+        return ArrayVectorStore(os.path.join(persist_directory, "array_index"), embedding_function, quantization=quantization)
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+
+        return Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+    raise ValueError(f"Unknown vector store backend {backend!r}")